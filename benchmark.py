@@ -0,0 +1,247 @@
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+from lookup_tables import doi_table, url_table
+import mapping_spec
+from metadata_converter import Metadata_converter
+
+# methods timed separately, in the order used by get_metadata
+METHODS = [
+    "convert_type",
+    "convert_creators",
+    "convert_contributors",
+    "convert_date",
+    "convert_simple_metadata",
+    "convert_keywords",
+    "additional_notes",
+    "convert_identifiers",
+    "convert_publication",
+    "convert_references",
+    "convert_subjects",
+    "convert_publisher",
+    "get_metadata",
+]
+
+WORDS = (
+    "atmospheric aerosol radiosonde cloud ozone lidar satellite climate model data "
+    "archive observation airborne campaign ice sea surface temperature precipitation"
+).split()
+
+
+class Benchmark_converter(Metadata_converter):
+    '''This class is Metadata_converter with network calls replaced by constant answers
+
+    '''
+
+    def get_depositing_user(self):
+        return "Benchmark User"
+
+
+def random_name(rng):
+    return {
+        "given": rng.choice(["Anna", "J.", "Piotr", ".", "Unknown", ""]),
+        "family": rng.choice(["Smith", "Kowalski", "Jones", "unknown", "."]),
+    }
+
+
+def random_text(rng, words, separator=" "):
+    return separator.join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_record(rng, record_id, record_type):
+    '''This function builds synthetic cedadocs record of given type
+
+    Args:
+        rng (random.Random): Source of randomness
+        record_id (int): ID of the record
+        record_type (str): Type in format 'type/subtype' used by convert_type
+    '''
+    main_type, _, subtype = record_type.partition("/")
+    # urls and DOIs are taken from the lookup tables, records of a new run directory (with empty tables) have none
+    urls = list(url_table.get())
+    dois = list(doi_table.get())
+
+    record = {
+        "eprintid": record_id,
+        "type": main_type,
+        "title": random_text(rng, 12) + "\r\n" + random_text(rng, 4),
+        "abstract": random_text(rng, 200),
+        "datestamp": "2015-06-01 12:00:00",
+        "date": rng.choice([2010, "2011-05", "2012-03-04"]),
+        "creators": [{"name": random_name(rng)} for _ in range(rng.randint(1, 40))],
+        "documents": [
+            {
+                "main": f"file_{d}.pdf",
+                "files": [
+                    {"filename": f"file_{d}_{f}.pdf", "uri": f"http://example.org/{d}/{f}"}
+                    for f in range(rng.randint(1, 5))
+                ],
+            }
+            for d in range(rng.randint(1, 10))
+        ],
+    }
+
+    if main_type == "monograph":
+        record["monograph_type"] = subtype
+    elif subtype:
+        record["pres_type"] = subtype
+
+    if main_type in ["article", "book", "monograph"]:
+        record["publication"] = random_text(rng, 3)
+
+    if rng.random() < 0.8:
+        record["keywords"] = random_text(rng, rng.randint(5, 80), rng.choice([", ", "; ", "\r\n"])) + "."
+    if rng.random() < 0.5:
+        record["editors"] = [{"name": random_name(rng)} for _ in range(rng.randint(1, 20))]
+        record["contributors"] = [{"name": random_name(rng)} for _ in range(rng.randint(1, 20))]
+    if rng.random() < 0.5:
+        record["funders"] = [random_text(rng, 3) for _ in range(rng.randint(1, 15))]
+        record["projects"] = [random_text(rng, 2) for _ in range(rng.randint(1, 10))]
+    if rng.random() < 0.5:
+        record["referencetext"] = "\r\n".join(random_text(rng, 25) for _ in range(rng.randint(10, 200)))
+    if urls and rng.random() < 0.5:
+        record["official_url"] = rng.choice(urls)
+    if rng.random() < 0.5:
+        record["subjects"] = rng.sample(
+            list(mapping_spec.SUBJECTS_MAP) + list(mapping_spec.KEYWORD_SUBJECTS), 4
+        )
+    if rng.random() < 0.5:
+        record["publisher"] = rng.choice(
+            list(mapping_spec.PUBLISHER_ACRONYMS) + ["N/A", "Some Publisher"]
+        )
+    if dois and rng.random() < 0.3:
+        record["succeeds"] = rng.choice(dois)
+    if rng.random() < 0.3:
+        record.update(
+            corp_creators=[random_text(rng, 3)],
+            copyright_holders=[random_text(rng, 2)],
+            institution=random_text(rng, 3),
+            department=random_text(rng, 2),
+            contact_email="someone@example.org",
+            id_number=rng.choice(["ISBN 978-3-16-148410-0", "doi:10.1000/182"]),
+            issn="1234-5678",
+            refereed=rng.choice([True, False]),
+            series=random_text(rng, 2),
+            date_type="published",
+            pages=rng.randint(1, 500),
+            number=rng.randint(1, 12),
+            volume=rng.randint(1, 90),
+        )
+
+    return record
+
+
+def make_records(count, seed=0):
+    '''This function builds synthetic records covering every branch of convert_type
+
+    Records mapped by hand (by ID) are included as well as records of every type and sub-type
+
+    Args:
+        count (int): Number of records
+        seed (int): Seed of the random generator, the same seed gives the same records
+    '''
+    rng = random.Random(seed)
+    types = list(mapping_spec.TYPE_MAP)
+    special_ids = list(
+        dict.fromkeys(
+            list(mapping_spec.TYPE_EXCEPTIONS)
+            + list(mapping_spec.KEYWORD_EXCEPTIONS)
+            + [830, 914]
+        )
+    )
+
+    records = []
+    for i in range(count):
+        record_id = special_ids[i] if i < len(special_ids) else 10000 + i
+        records.append(make_record(rng, record_id, types[i % len(types)]))
+
+    # one record has 'skill_areas' instead of keywords
+    records[-1]["skill_areas"] = ["data management"]
+    return records
+
+
+def run_benchmark(records, repeat=3):
+    '''This function times every conversion method over the records
+
+    Best of `repeat` runs is reported. Memory is measured in a separate run under tracemalloc
+
+    Args:
+        records (list): cedadocs records
+        repeat (int): Number of timed runs of each method
+
+    Returns:
+        dict: Results of every method: records/sec, mean time and memory allocated per record
+    '''
+    results = dict()
+
+    # converters are built once, so only conversion itself is measured
+    converters = [Benchmark_converter(r, offline=True) for r in records]
+
+    start = perf_counter()
+    for record in records:
+        Benchmark_converter(record, offline=True)
+    init_time = perf_counter() - start
+    results["__init__"] = {
+        "records_per_sec": len(records) / init_time,
+        "mean_us": init_time / len(records) * 1e6,
+    }
+
+    for method in METHODS:
+        best = float("inf")
+        for _ in range(repeat):
+            start = perf_counter()
+            for converter in converters:
+                getattr(converter, method)()
+            best = min(best, perf_counter() - start)
+
+        tracemalloc.start()
+        allocated = 0
+        for converter in converters:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            getattr(converter, method)()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        results[method] = {
+            "records_per_sec": len(records) / best,
+            "mean_us": best / len(records) * 1e6,
+            "peak_bytes_per_record": allocated / len(records),
+        }
+
+    return results
+
+
+def compare(old, new):
+    '''This function prints change of records/sec of every method between two benchmark results
+
+    '''
+    for method, result in new["results"].items():
+        if method in old["results"]:
+            ratio = result["records_per_sec"] / old["results"][method]["records_per_sec"]
+            print(f"{method:25} {ratio:6.2f}x")
+
+
+if __name__ == "__main__":
+    # usage: python benchmark.py [number_of_records] [output.json] [baseline.json]
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    output = {
+        "python": platform.python_version(),
+        "records": count,
+        "results": run_benchmark(make_records(count)),
+    }
+
+    for method, result in output["results"].items():
+        print(f"{method:25} {result['records_per_sec']:12.0f} records/s {result['mean_us']:10.1f} us")
+
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            json.dump(output, f, indent=2)
+
+    if len(sys.argv) > 3:
+        with open(sys.argv[3]) as f:
+            compare(json.load(f), output)
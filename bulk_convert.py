@@ -0,0 +1,212 @@
+import json
+import os
+import re
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import record_cache
+from metadata_converter import Metadata_converter, TRANSFER_DATE
+from lookup_tables import doi_table, url_table
+from url_index import url_index
+from depositing_user import depositing_users
+from record_cache import Record_cache
+from bulk_export import iter_chunks, iter_records
+
+# part of the url of cedadocs JSON exports
+EXPORT_URL_PART = "/cgi/export/eprint/"
+
+# number of processes converting records and number of records sent to a process at once
+CONVERT_WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 64
+
+# options of conversion in worker processes, set by init_worker
+_options = {"depositing_user": True}
+
+
+def natural_key(name):
+    '''This function sorts names containing numbers in numeric order, e.g. 'ceda-eprint-9.js' before 'ceda-eprint-10.js'
+
+    '''
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def iter_exports(path):
+    '''This function yields cedadocs records (JSON representations) stored at given path
+
+    Path can be:
+        directory of the record cache (with index.db)
+        directory of JSON exports (*.js or *.json files, searched recursively)
+        zip or tar archive of JSON exports
+        bulk JSON export of many records (a file or url), read incrementally
+
+    Args:
+        path (str): Path to the directory or archive
+    '''
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, "index.db")):
+        cache = Record_cache(path, offline=True)
+        for _, body in cache.cached(EXPORT_URL_PART):
+            yield json.loads(body)
+
+    elif os.path.isdir(path):
+        names = []
+        for root, _, files in os.walk(path):
+            names += [os.path.join(root, f) for f in files if f.endswith((".js", ".json"))]
+        for name in sorted(names, key=natural_key):
+            with open(name, "rb") as f:
+                yield json.load(f)
+
+    elif path.startswith(("http://", "https://")) or path.endswith((".js", ".json")):
+        yield from iter_records(iter_chunks(path))
+
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [n for n in archive.namelist() if n.endswith((".js", ".json"))]
+            for name in sorted(names, key=natural_key):
+                yield json.loads(archive.read(name))
+
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            members = [m for m in archive.getmembers() if m.isfile() and m.name.endswith((".js", ".json"))]
+            for member in sorted(members, key=lambda m: natural_key(m.name)):
+                yield json.load(archive.extractfile(member))
+
+    else:
+        raise ValueError(f"{path} is neither a directory nor an archive")
+
+
+def load_tables():
+    '''This function loads lookup tables used by the conversion
+
+    Tables loaded before worker processes are started are shared with them (they are only read),
+    otherwise every worker loads them once
+    '''
+    for table in (doi_table, url_table, url_index, depositing_users):
+        table.get()
+
+
+def init_worker(depositing_user):
+    '''This function prepares worker process of the conversion pool
+
+    Args:
+        depositing_user (bool): If False, depositing user is not taken even from the cache
+    '''
+    _options.update(depositing_user=depositing_user)
+    # connection to the record cache cannot be shared with the parent process, every worker opens its own
+    record_cache.configure()
+    load_tables()
+
+
+def convert_chunk(records):
+    '''This function converts part of the records with options set by init_worker
+
+    Returns:
+        list: Pairs of output line (None if record cannot be converted) and error message
+    '''
+    results = []
+    for record in records:
+        try:
+            metadata = Metadata_converter(
+                record, offline=True, depositing_user=_options["depositing_user"]
+            ).get_metadata()
+        except Exception as e:
+            results.append((None, f"Record {record.get('eprintid')} failed with {e!r}"))
+            continue
+
+        line = {"record_id": record["eprintid"], **metadata}
+        results.append((json.dumps(line, sort_keys=True) + "\n", None))
+    return results
+
+
+def iter_converted(records, depositing_user=True, workers=1, chunk_size=CHUNK_SIZE):
+    '''This function yields results of convert_chunk for every record, in the order of the records
+
+    With more than one worker, records are converted by a pool of processes in parts of `chunk_size`.
+    At most two parts per worker are read ahead, so records are streamed and memory stays bounded
+
+    Args:
+        records (iterable): cedadocs records (JSON representations)
+        depositing_user (bool): If False, depositing user is not taken even from the cache
+        workers (int): Number of processes converting records
+        chunk_size (int): Number of records sent to a process at once
+    '''
+    records = iter(records)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+
+    if workers <= 1:
+        init_worker(depositing_user)
+        for chunk in chunks:
+            yield from convert_chunk(chunk)
+        return
+
+    load_tables()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(depositing_user,)
+    ) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(convert_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def convert_records(records, output_path, depositing_user=True, workers=1):
+    '''This function converts records to Zenodo metadata without using network
+
+    Each record is written as a single JSON line: {"record_id": ..., "metadata": {...}}, in the order
+    of the records whatever the number of workers. Records which cannot be converted are reported and skipped
+
+    Args:
+        records (iterable): cedadocs records (JSON representations)
+        output_path (str): Path to the JSON Lines output file
+        depositing_user (bool): If False, depositing user is not taken even from the cache
+        workers (int): Number of processes converting records
+
+    Returns:
+        int: Number of converted records
+    '''
+    counter = 0
+    with open(output_path, "w") as f:
+        for line, error in iter_converted(records, depositing_user, workers):
+            if line is None:
+                print(error)
+                continue
+            f.write(line)
+            counter += 1
+
+    return counter
+
+
+def load_output(path):
+    '''This function reads JSON Lines output of convert_records as a map of record ID to line
+
+    Transfer date in notes is replaced with a placeholder, so outputs of different days can be compared
+    '''
+    lines = dict()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                lines[json.loads(line)["record_id"]] = TRANSFER_DATE.sub(r"\1<date>", line)
+    return lines
+
+
+def compare_outputs(golden_path, output_path):
+    '''This function compares output of convert_records with a golden file, record by record
+
+    Args:
+        golden_path (str): Path to the JSON Lines output known to be correct
+        output_path (str): Path to the JSON Lines output to be checked
+
+    Returns:
+        list: IDs of records which are different or missing in either file
+    '''
+    golden = load_output(golden_path)
+    output = load_output(output_path)
+    return sorted(
+        record_id
+        for record_id in golden.keys() | output.keys()
+        if golden.get(record_id) != output.get(record_id)
+    )
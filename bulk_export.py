@@ -0,0 +1,142 @@
+import codecs
+import json
+import os
+import re
+from migration_state import get_state, PUBLISHED
+from record_cache import get_cache, export_url, CEDADOCS_URL
+
+# JSON export of every record of the repository, can be overridden
+EXPORT_PATH = "cgi/search/archive/advanced/export_cedadocs_JSON.js"
+EXPORT_URL = os.environ.get(
+    "CEDADOCS_EXPORT_URL",
+    f"{CEDADOCS_URL}{EXPORT_PATH}?dataset=archive&order=eprintid&_action_export=1&output=JSON",
+)
+
+# size of the parts of the export read at once and number of records registered at once
+CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 100
+
+WHITESPACE = re.compile(r"\s*")
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    '''This function yields the export part by part, downloading it or reading it from a local file
+
+    Args:
+        source (str): URL of the export or path to the file
+        chunk_size (int): Size of the parts in bytes
+    '''
+    if source.startswith(("http://", "https://")):
+        from http_session import get_session
+
+        with get_session().get(source, stream=True) as r:
+            r.raise_for_status()
+            yield from r.iter_content(chunk_size)
+    else:
+        with open(source, "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+
+
+def iter_records(chunks):
+    '''This function parses JSON array of records incrementally, yielding records one at a time
+
+    Only the record being parsed and the part of the export it is in are kept in memory
+
+    Args:
+        chunks (iterable): Parts of the export as bytes
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+
+        record = None
+        if position < len(buffer):
+            char = buffer[position]
+            if not started:
+                if char != "[":
+                    raise ValueError("Export is not a JSON array")
+                started = True
+                position += 1
+                continue
+            if char == "]":
+                return
+            if char == ",":
+                position += 1
+                continue
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+
+        if record is not None:
+            yield record
+            continue
+
+        # record goes on in the next parts of the export, it is parsed again once they double its text
+        if eof:
+            if started:
+                raise ValueError("Export ended before the end of the array")
+            return
+        parts = [buffer[position:]]
+        needed = max(1, len(parts[0]))
+        while needed > 0:
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                parts.append(text_decoder.decode(b"", final=True))
+                break
+            parts.append(text_decoder.decode(chunk))
+            needed -= len(parts[-1])
+        buffer = "".join(parts)
+        position = 0
+
+
+def ingest(source=EXPORT_URL):
+    '''This function yields records of the export one at a time
+
+    IDs of the records are added to the migration state and every record is saved to the record cache
+    as its single record export, so get_record is served without a request. Records are registered
+    in batches of BATCH_SIZE before they are yielded
+
+    Args:
+        source (str): URL of the export or path to the file
+    '''
+    state = get_state()
+    cache = get_cache()
+
+    batch = []
+    for record in iter_records(iter_chunks(source)):
+        url = export_url(record["eprintid"])
+        cache.store_body(cache.get_key(url), url, record["eprintid"], json.dumps(record).encode())
+        batch.append(record)
+
+        if len(batch) >= BATCH_SIZE:
+            state.add_ids([r["eprintid"] for r in batch])
+            yield from batch
+            batch = []
+
+    state.add_ids([r["eprintid"] for r in batch])
+    yield from batch
+
+
+def pending_records(source, first_id=None, last_id=None):
+    '''This function yields records of the export in range `first_id <= id < last_id` which have not been published yet
+
+    '''
+    state = get_state()
+    for record in ingest(source):
+        record_id = record["eprintid"]
+        if first_id is not None and record_id < first_id:
+            continue
+        if last_id is not None and record_id >= last_id:
+            continue
+        if state.get(record_id)["status"] != PUBLISHED:
+            yield record
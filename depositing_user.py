@@ -0,0 +1,157 @@
+import codecs
+import json
+import os
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from lookup_tables import Table_cache
+from record_cache import get_cache, Cache_miss, Fetch_error, CEDADOCS_URL
+
+DEPOSITING_USERS_FILE = "depositing_users.json"
+
+# class of the span holding depositing user on the record page
+CITATION_CLASS = "ep_name_citation"
+
+# size of the parts of the page fed to the parser and number of pages resolved at the same time
+PARSE_CHUNK_SIZE = 4096
+RESOLVE_WORKERS = 16
+
+
+class Citation_parser(HTMLParser):
+    '''This class reads text of the first span inside the first `span.ep_name_citation`
+
+    It is fed with parts of the page and sets `done` as soon as the span is closed,
+    so the rest of the page does not have to be parsed
+    '''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_citation = False
+        self.depth = 0
+        self.text = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "span" or self.done:
+            return
+
+        if self.depth:
+            self.depth += 1
+        elif self.in_citation:
+            self.depth = 1
+        elif CITATION_CLASS in (dict(attrs).get("class") or "").split():
+            self.in_citation = True
+
+    def handle_endtag(self, tag):
+        if tag != "span" or self.done:
+            return
+
+        if self.depth:
+            self.depth -= 1
+            self.done = not self.depth
+        elif self.in_citation:
+            # citation without a name inside
+            self.done = True
+
+    def handle_data(self, data):
+        if self.depth and not self.done:
+            self.text.append(data)
+
+
+def parse_depositing_user(page):
+    '''This function returns depositing user from the record page
+
+    Page is parsed from the citation span onwards, part by part, until the user is found
+
+    Args:
+        page (bytes): HTML of the record page
+
+    Returns:
+        str: Name of depositing user, empty string if there is none
+    '''
+    start = page.find(CITATION_CLASS.encode())
+    if start == -1:
+        return ""
+    start = page.rfind(b"<", 0, start)
+
+    parser = Citation_parser()
+    # characters split between parts are decoded once their last byte arrives
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    for offset in range(start, len(page), PARSE_CHUNK_SIZE):
+        parser.feed(decoder.decode(page[offset:offset + PARSE_CHUNK_SIZE]))
+        if parser.done:
+            break
+    return "".join(parser.text)
+
+
+def resolve(record_id, offline=None):
+    '''This function returns depositing user of the record, taking its page from the record cache
+
+    Args:
+        record_id (int): ID of cedadocs record
+        offline (bool): Overrides offline mode of the cache, if given
+
+    Returns:
+        str: Name of depositing user (None if the page is not in the cache in offline mode or could not be fetched)
+    '''
+    try:
+        page = get_cache().fetch(
+            f"{CEDADOCS_URL}{record_id}", record_id, offline=offline, raise_errors=True
+        )
+    except Cache_miss:
+        return None
+    except Fetch_error as e:
+        print(f"Depositing user of record {record_id} not resolved: {e}")
+        return None
+    return parse_depositing_user(page)
+
+
+def load_depositing_users(path):
+    '''This function loads depositing users saved by resolve_all
+
+    Args:
+        path (str): Path to JSON file of depositing users by record ID
+    '''
+    with open(path) as f:
+        return {int(record_id): user for record_id, user in json.load(f).items()}
+
+
+def resolve_all(id_list, path=DEPOSITING_USERS_FILE, workers=RESOLVE_WORKERS):
+    '''This function resolves depositing users of many records at once and saves them
+
+    Pages are fetched through the record cache by `workers` threads. Records resolved by an earlier run are skipped
+
+    Args:
+        id_list (list): IDs of cedadocs records
+        path (str): Path to JSON file of depositing users by record ID
+        workers (int): Number of pages fetched at the same time
+
+    Returns:
+        int: Number of newly resolved records
+    '''
+    users = load_depositing_users(path) if os.path.exists(path) else dict()
+    to_resolve = [record_id for record_id in id_list if record_id not in users]
+
+    def resolve_record(record_id):
+        # one broken page must not stop the whole batch
+        try:
+            return resolve(record_id)
+        except Exception as e:
+            print(f"Depositing user of record {record_id} failed with {e!r}")
+            return None
+
+    resolved = dict()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record_id, user in zip(to_resolve, executor.map(resolve_record, to_resolve)):
+            if user is not None:
+                resolved[record_id] = user
+
+    # file is replaced at once, so readers never see a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({**users, **resolved}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+    return len(resolved)
+
+
+depositing_users = Table_cache(DEPOSITING_USERS_FILE, load_depositing_users)
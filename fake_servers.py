@@ -0,0 +1,466 @@
+import json
+import random
+import re
+import sys
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread
+from time import sleep, time
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+# number of identifiers listed on a single page of the fake OAI-PMH interface
+OAI_PAGE_SIZE = 50
+
+
+class Fake_settings:
+    '''This class holds behaviour of a fake server which can be changed while it is running
+
+    '''
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=None, window=60, body_rate=None):
+        ''' Init method of the class
+
+        Args:
+            latency (float): Seconds added to every response
+            error_rate (float): Probability of answering with status code 500 or 503
+            rate_limit (int): Number of requests allowed in every window, no limit if None
+            window (int): Length of the rate limit window in seconds
+            body_rate (int): Bytes per second at which response bodies are sent, no limit if None
+        '''
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.window = window
+        self.body_rate = body_rate
+
+        self.lock = Lock()
+        self.window_start = time()
+        self.window_requests = 0
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.status_codes = dict()
+
+    def take_request(self):
+        '''This method counts request in the current rate limit window
+
+        Returns:
+            tuple: (allowed, remaining, reset) where reset is epoch time of the next window
+        '''
+        with self.lock:
+            self.requests += 1
+            now = time()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            reset = int(self.window_start + self.window)
+            if self.rate_limit is None:
+                return True, None, reset
+            remaining = max(0, self.rate_limit - self.window_requests)
+            return self.window_requests <= self.rate_limit, remaining, reset
+
+    def count_response(self, status_code, body_size):
+        with self.lock:
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+            self.bytes_sent += body_size
+
+    def count_received(self, size):
+        with self.lock:
+            self.bytes_received += size
+
+    def summary(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "status_codes": dict(self.status_codes),
+            }
+
+
+class Fake_handler(BaseHTTPRequestHandler):
+    '''This class is base of fake request handlers: latency, errors, rate limits and slow bodies
+
+    Subclasses implement `route(method, path, query)` which returns (status code, body, headers)
+    '''
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        '''This method reads request body, sent either with Content-Length or in chunks
+
+        '''
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        self.server.settings.count_received(len(body))
+        return body
+
+    def handle_request(self, method):
+        settings = self.server.settings
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        self.request_body = self.read_body() if method in ["POST", "PUT"] else b""
+
+        if settings.latency:
+            sleep(settings.latency)
+
+        allowed, remaining, reset = settings.take_request()
+        headers = dict()
+        if remaining is not None:
+            headers["X-RateLimit-Limit"] = str(settings.rate_limit)
+            headers["X-RateLimit-Remaining"] = str(remaining)
+            headers["X-RateLimit-Reset"] = str(reset)
+
+        if not allowed:
+            headers["Retry-After"] = str(max(1, int(reset - time())))
+            status, body = 429, {"status": 429, "message": "Too many requests"}
+        elif random.random() < settings.error_rate:
+            status, body = random.choice([500, 503]), {"message": "Injected error"}
+        else:
+            status, body, route_headers = self.route(method, url.path, query)
+            headers.update(route_headers)
+
+        self.send(status, body, headers)
+
+    def send(self, status, body, headers):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers.setdefault("Content-Type", "application/json")
+        elif isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        # slow bodies are sent in small parts
+        body_rate = self.server.settings.body_rate
+        if body_rate and self.command != "HEAD":
+            part = max(1, body_rate // 10)
+            for i in range(0, len(body), part):
+                self.wfile.write(body[i:i + part])
+                sleep(0.1)
+        elif self.command != "HEAD":
+            self.wfile.write(body)
+
+        self.server.settings.count_response(status, len(body))
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class Fake_zenodo_handler(Fake_handler):
+    '''This class imitates parts of Zenodo deposition API used by Transfer_to_zenodo
+
+    '''
+
+    def route(self, method, path, query):
+        zenodo = self.server.zenodo
+        base_url = self.server.base_url
+
+        if path == "/api/deposit/depositions":
+            if method == "POST":
+                return 201, zenodo.create(base_url), {}
+            if method == "GET":
+                return 200, zenodo.list(query), {}
+
+        match = re.fullmatch(r"/api/deposit/depositions/(\d+)(/actions/(\w+))?", path)
+        if match:
+            dep_id, action = int(match[1]), match[3]
+            deposition = zenodo.depositions.get(dep_id)
+            if deposition is None:
+                return 404, {"status": 404, "message": "PID does not exist."}, {}
+
+            if action:
+                return zenodo.action(deposition, action, base_url)
+            if method == "GET":
+                return 200, zenodo.view(deposition), {}
+            if method == "PUT":
+                return zenodo.update(deposition, self.request_body)
+            if method == "DELETE":
+                return zenodo.delete(deposition)
+
+        match = re.fullmatch(r"/api/files/([\w-]+)(/(.+))?", path)
+        if match and match[1] in zenodo.buckets:
+            bucket = zenodo.buckets[match[1]]
+            if not match[3] and method == "GET":
+                return 200, {"contents": list(bucket.values())}, {}
+            if match[3] and method == "PUT":
+                return 201, zenodo.put_file(bucket, match[3], self.request_body), {}
+            if match[3] and method == "DELETE":
+                with zenodo.lock:
+                    bucket.pop(match[3], None)
+                return 204, b"", {}
+
+        return 404, {"status": 404, "message": "Not found"}, {}
+
+
+class Fake_zenodo:
+    '''This class keeps depositions and buckets of the fake Zenodo server
+
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.ids = count(1)
+        self.depositions = dict()
+        self.buckets = dict()
+
+    def create(self, base_url):
+        with self.lock:
+            dep_id = next(self.ids)
+            bucket_id = str(uuid4())
+            self.buckets[bucket_id] = dict()
+            deposition = {
+                "id": dep_id,
+                "submitted": False,
+                "state": "unsubmitted",
+                "metadata": {},
+                "bucket_id": bucket_id,
+                "links": {"bucket": f"{base_url}api/files/{bucket_id}"},
+            }
+            self.depositions[dep_id] = deposition
+        return self.view(deposition)
+
+    def view(self, deposition):
+        result = {k: v for k, v in deposition.items() if k != "bucket_id"}
+        result["files"] = [
+            {"filename": f["key"], "filesize": f["size"], "checksum": f["checksum"][4:]}
+            for f in self.buckets[deposition["bucket_id"]].values()
+        ]
+        return result
+
+    def list(self, query):
+        size = int(query.get("size", 10))
+        page = int(query.get("page", 1))
+        status = query.get("status")
+        with self.lock:
+            depositions = sorted(self.depositions.values(), key=lambda d: -d["id"])
+        if status == "draft":
+            depositions = [d for d in depositions if not d["submitted"]]
+        elif status == "published":
+            depositions = [d for d in depositions if d["submitted"]]
+        return [self.view(d) for d in depositions[(page - 1) * size:page * size]]
+
+    def update(self, deposition, body):
+        if deposition["state"] == "done":
+            return 400, {"status": 400, "message": "Deposition is published, use edit action first"}, {}
+        try:
+            deposition["metadata"] = json.loads(body)["metadata"]
+        except (ValueError, KeyError):
+            return 400, {"status": 400, "message": "Invalid metadata"}, {}
+        return 200, self.view(deposition), {}
+
+    def delete(self, deposition):
+        if deposition["submitted"]:
+            return 403, {"status": 403, "message": "Published deposition cannot be deleted"}, {}
+        with self.lock:
+            del self.depositions[deposition["id"]]
+        return 204, b"", {}
+
+    def action(self, deposition, action, base_url):
+        if action == "publish":
+            if not self.buckets[deposition["bucket_id"]]:
+                return 400, {"status": 400, "message": "Missing uploaded files"}, {}
+            deposition.update(submitted=True, state="done")
+            deposition.setdefault("doi", f"10.5072/zenodo.{deposition['id']}")
+            return 202, self.view(deposition), {}
+
+        if action == "edit":
+            deposition["state"] = "inprogress"
+            return 201, self.view(deposition), {}
+
+        if action == "discard":
+            deposition["state"] = "done"
+            return 201, self.view(deposition), {}
+
+        if action == "newversion":
+            new_version = self.create(base_url)
+            new = self.depositions[new_version["id"]]
+            new["metadata"] = dict(deposition["metadata"])
+            self.buckets[new["bucket_id"]] = dict(self.buckets[deposition["bucket_id"]])
+            result = self.view(deposition)
+            result["links"] = dict(deposition["links"], latest_draft=f"{base_url}api/deposit/depositions/{new['id']}")
+            return 201, result, {}
+
+        return 404, {"status": 404, "message": "Unknown action"}, {}
+
+    def put_file(self, bucket, key, body):
+        entry = {"key": key, "size": len(body), "checksum": f"md5:{md5(body).hexdigest()}"}
+        with self.lock:
+            bucket[key] = entry
+        return entry
+
+
+class Fake_cedadocs_handler(Fake_handler):
+    '''This class imitates cedadocs: JSON exports, record pages and files
+
+    '''
+
+    def export(self, record):
+        '''This method returns record as exported by cedadocs
+
+        '''
+        # files are served by this server as well
+        return dict(record, documents=[
+            dict(doc, files=[
+                dict(f, uri=f"{self.server.base_url}files/{record['eprintid']}/{f['filename']}")
+                for f in doc["files"]
+            ])
+            for doc in record["documents"]
+        ])
+
+    def route(self, method, path, query):
+        cedadocs = self.server.cedadocs
+
+        match = re.fullmatch(r"/cgi/export/eprint/(\d+)/JSON/.*", path)
+        if match and int(match[1]) in cedadocs.records:
+            record = cedadocs.records[int(match[1])]
+            etag = f'"{record["eprintid"]}-{record.get("lastmod", record["datestamp"])}"'
+            if self.headers.get("If-None-Match") == etag:
+                return 304, b"", {"ETag": etag}
+            return 200, self.export(record), {"ETag": etag}
+
+        # bulk export of every record
+        if path == "/cgi/search/archive/advanced/export_cedadocs_JSON.js":
+            return 200, [self.export(r) for r in cedadocs.records.values()], {}
+
+        if path == "/cgi/oai2" and query.get("verb") == "ListIdentifiers":
+            return 200, cedadocs.list_identifiers(query), {"Content-Type": "text/xml; charset=utf-8"}
+
+        match = re.fullmatch(r"/(\d+)/?", path)
+        if match and int(match[1]) in cedadocs.records:
+            page = (
+                "<html><body><table><tr><th>Depositing User:</th><td>"
+                '<span class="ep_name_citation"><span class="person_name">Fake User</span></span>'
+                "</td></tr></table></body></html>"
+            )
+            return 200, page, {"Content-Type": "text/html; charset=utf-8"}
+
+        match = re.fullmatch(r"/files/(\d+)/(.+)", path)
+        if match:
+            return 200, cedadocs.file_body, {"Content-Type": "application/octet-stream"}
+
+        return 404, b"Not found", {}
+
+
+class Fake_cedadocs:
+    '''This class keeps records served by the fake cedadocs server
+
+    '''
+
+    def __init__(self, records, file_size=1024):
+        ''' Init method of the class
+
+        Args:
+            records (list): cedadocs records served by the server
+            file_size (int): Size in bytes of every served file
+        '''
+        self.records = {r["eprintid"]: r for r in records}
+        self.file_body = bytes(random.getrandbits(8) for _ in range(min(file_size, 4096)))
+        self.file_body = (self.file_body * (file_size // len(self.file_body) + 1))[:file_size]
+
+    def list_identifiers(self, query):
+        '''This method answers OAI-PMH ListIdentifiers request, OAI_PAGE_SIZE records at a time
+
+        Records modified on or after the date in 'from' are listed, the resumption token is the offset of the next page
+        '''
+        offset = int(query.get("resumptionToken") or 0)
+        since = query.get("from", "")
+        records = sorted(
+            (r for r in self.records.values() if r.get("lastmod", r["datestamp"])[:10] >= since),
+            key=lambda r: r["eprintid"],
+        )
+        if not records:
+            return '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><error code="noRecordsMatch"/></OAI-PMH>'
+
+        page = records[offset:offset + OAI_PAGE_SIZE]
+        headers = "".join(
+            f"<header><identifier>oai:cedadocs.ceda.ac.uk:{r['eprintid']}</identifier>"
+            f"<datestamp>{r.get('lastmod', r['datestamp']).replace(' ', 'T')}Z</datestamp></header>"
+            for r in page
+        )
+        token = offset + OAI_PAGE_SIZE if offset + OAI_PAGE_SIZE < len(records) else ""
+        return (
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListIdentifiers>'
+            f"{headers}<resumptionToken>{token}</resumptionToken></ListIdentifiers></OAI-PMH>"
+        )
+
+
+def start_server(handler, settings, **attributes):
+    '''This function starts a fake server in a background thread
+
+    Args:
+        handler (class): Request handler of the server
+        settings (Fake_settings): Behaviour of the server
+        attributes: Extra attributes of the server used by the handler
+
+    Returns:
+        ThreadingHTTPServer: Running server, its url is kept in `base_url`
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.settings = settings
+    server.base_url = f"http://127.0.0.1:{server.server_port}/"
+    for name, value in attributes.items():
+        setattr(server, name, value)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_fake_zenodo(settings=None):
+    return start_server(Fake_zenodo_handler, settings or Fake_settings(), zenodo=Fake_zenodo())
+
+
+def start_fake_cedadocs(records, file_size=1024, settings=None):
+    return start_server(
+        Fake_cedadocs_handler,
+        settings or Fake_settings(),
+        cedadocs=Fake_cedadocs(records, file_size),
+    )
+
+
+if __name__ == "__main__":
+    # usage: python fake_servers.py [number_of_records]
+    from benchmark import make_records
+
+    records = make_records(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
+    zenodo = start_fake_zenodo()
+    cedadocs = start_fake_cedadocs(records)
+    print(f"ZENODO_URL={zenodo.base_url}")
+    print(f"CEDADOCS_URL={cedadocs.base_url}")
+    print(f"Record IDs: {', '.join(str(r['eprintid']) for r in records)}")
+    try:
+        while True:
+            sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,44 @@
+from hashlib import md5
+
+# size of a single chunk kept in memory while a file is passed to Zenodo
+CHUNK_SIZE = 1024 * 1024
+
+
+class File_stream:
+    '''This class passes body of a source response to the upload request in chunks
+
+    Only one chunk is held in memory at a time, so memory usage does not depend on the size of the file.
+    If source reports its size, upload is sent with the same Content-Length, otherwise chunked encoding is used.
+    MD5 checksum of the passed bytes is computed on the way
+    '''
+
+    def __init__(self, response, chunk_size=CHUNK_SIZE):
+        ''' Init method of the class
+
+        Args:
+            response (requests.Response): Response of the source file opened with `stream=True`
+            chunk_size (int): Number of bytes read from the source at once
+        '''
+        self.response = response
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self.md5 = md5()
+
+        # size is only known if body is sent as it is stored
+        self.length = 0
+        if "Content-Encoding" not in response.headers:
+            self.length = int(response.headers.get("Content-Length", 0))
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for chunk in self.response.iter_content(self.chunk_size):
+            self.bytes_read += len(chunk)
+            self.md5.update(chunk)
+            yield chunk
+
+    @property
+    def checksum(self):
+        '''Checksum of bytes passed so far, in the format used by Zenodo ('md5:...')'''
+        return f"md5:{self.md5.hexdigest()}"
@@ -0,0 +1,111 @@
+import requests
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from urllib.parse import urlsplit
+from time import time
+from tracing import save_measured
+
+# number of keep-alive connections kept open for every host
+POOL_SIZE = 16
+# (connect, read) timeouts in seconds used when a call does not set its own
+TIMEOUT = (10, 300)
+# number of times a request is repeated after 429 status code
+MAX_RETRIES = 5
+
+# rate limiters shared by all requests sent to a host
+RATE_LIMITERS = dict()
+
+_session = None
+_session_lock = Lock()
+
+
+class Pooled_session(requests.Session):
+    '''This class is a requests session with connection pooling and default timeouts
+
+    One instance is shared by every Transfer_to_zenodo and Metadata_converter object,
+    so consecutive calls to zenodo.org and cedadocs.ceda.ac.uk reuse open connections
+    '''
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=TIMEOUT):
+        ''' Init method of the class
+
+        Args:
+            pool_size (int): Maximum number of connections kept open for a single host
+            timeout (tuple): Default (connect, read) timeouts in seconds
+        '''
+        super().__init__()
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        '''This method sends request, using default timeout if none is given
+
+        Requests to hosts with a rate limiter wait for it and are repeated after 429 status code,
+        unless their body is a stream which cannot be sent again
+        '''
+        kwargs.setdefault("timeout", self.timeout)
+
+        limiter = RATE_LIMITERS.get(urlsplit(url).netloc)
+        if limiter is None:
+            return super().request(method, url, **kwargs)
+
+        data = kwargs.get("data")
+        replayable = data is None or isinstance(data, (bytes, str, dict, list, tuple))
+
+        for _ in range(MAX_RETRIES + 1):
+            # only requests which have actually been held back are traced
+            started = time()
+            waited = limiter.acquire()
+            if waited:
+                save_measured("rate_limit_wait", started, waited, host=urlsplit(url).netloc)
+            response = None
+            try:
+                response = super().request(method, url, **kwargs)
+            finally:
+                limiter.release(response)
+
+            if response.status_code != 429 or not replayable:
+                break
+
+        return response
+
+
+def configure(pool_size=POOL_SIZE, timeout=TIMEOUT):
+    '''This function replaces shared session with a new one of given settings
+
+    It should be called before any worker starts sending requests
+
+    Args:
+        pool_size (int): Maximum number of connections kept open for a single host
+        timeout (tuple): Default (connect, read) timeouts in seconds
+    '''
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = Pooled_session(pool_size, timeout)
+    return _session
+
+
+def limit_host(host, limiter):
+    '''This function makes every request sent to the host go through the limiter
+
+    Args:
+        host (str): Host name (with port, if any), e.g. 'zenodo.org'
+        limiter (Rate_limiter): Limiter shared by all requests to the host
+    '''
+    RATE_LIMITERS[host] = limiter
+
+
+def get_session():
+    '''This function returns shared session, creating it on first use
+
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Pooled_session()
+        return _session
@@ -0,0 +1,74 @@
+import subprocess
+import sys
+
+# modules started by short commands and worker processes: budget of their import in milliseconds
+# and heavy modules they must not pull in
+BUDGETS = {
+    "main": (50, ["requests", "transfer_to_zenodo", "metadata_converter"]),
+    "run_report": (50, ["requests", "sqlite3"]),
+    "metadata_converter": (150, ["requests", "black", "bs4"]),
+    "bulk_convert": (150, ["requests", "black", "bs4"]),
+}
+
+# imports are timed several times and the best time is taken, as the first run includes disk reads
+REPEAT = 5
+
+
+def measure_import(module):
+    '''This function imports module in a new interpreter and reads import times reported by `-X importtime`
+
+    Args:
+        module (str): Name of the module
+
+    Returns:
+        tuple: Cumulative import time of the module in milliseconds and names of all imported modules
+    '''
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imported.add(name.strip())
+        # the module itself is the only one imported directly by the command
+        if name.strip() == module and not name[1:].startswith(" "):
+            total = int(cumulative) / 1000
+
+    return total, imported
+
+
+def check_budgets(budgets=BUDGETS, repeat=REPEAT):
+    '''This function checks import time and imported modules of every module against its budget
+
+    Returns:
+        list: Descriptions of exceeded budgets
+    '''
+    failures = []
+    for module, (budget, forbidden) in budgets.items():
+        runs = [measure_import(module) for _ in range(repeat)]
+        best = min(total for total, _ in runs)
+        heavy = sorted(m for m in forbidden if m in runs[0][1])
+
+        print(f"{module:20} {best:8.1f} ms (budget {budget} ms)")
+        if best > budget:
+            failures.append(f"{module} imports in {best:.1f} ms, budget is {budget} ms")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    # usage: python import_budget.py [module ...]
+    names = sys.argv[1:] or list(BUDGETS)
+    failures = check_budgets({name: BUDGETS[name] for name in names})
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
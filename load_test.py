@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+from benchmark import make_records
+from fake_servers import Fake_settings, start_fake_cedadocs, start_fake_zenodo
+
+URL_FILE = "cedadocs official url updates - Sheet1.csv"
+
+
+def prepare_directory(directory, records):
+    '''This function creates files main.py needs to run over the records
+
+    '''
+    with open(os.path.join(directory, "all_ids.txt"), "w") as f:
+        for record in records:
+            f.write(f"{record['eprintid']}\n")
+    open(os.path.join(directory, "doi_list.csv"), "w").close()
+    with open(os.path.join(directory, "errors.csv"), "w") as f:
+        f.write("record_id,datetime,creation_status_code,metadata_status_code,file_upload_status_code,file_which_caused_problem\n")
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), URL_FILE), directory)
+
+
+def run_load_test(records, file_size, main_args, zenodo_settings, cedadocs_settings):
+    '''This function runs range mode of main.py against fake Zenodo and cedadocs servers
+
+    Args:
+        records (list): cedadocs records served by fake cedadocs
+        file_size (int): Size in bytes of every file
+        main_args (list): Extra arguments of main.py, e.g. ['--workers', '8']
+        zenodo_settings (Fake_settings): Behaviour of fake Zenodo
+        cedadocs_settings (Fake_settings): Behaviour of fake cedadocs
+
+    Returns:
+        dict: Throughput of the run and statistics of both servers
+    '''
+    zenodo = start_fake_zenodo(zenodo_settings)
+    cedadocs = start_fake_cedadocs(records, file_size, cedadocs_settings)
+
+    ids = sorted(r["eprintid"] for r in records)
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    env = dict(
+        os.environ,
+        ZENODO_URL=zenodo.base_url,
+        CEDADOCS_URL=cedadocs.base_url,
+        ZENODO_TOKEN="fake-token",
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_directory(directory, records)
+
+        start = perf_counter()
+        subprocess.run(
+            [sys.executable, main_path, "range", str(ids[0]), str(ids[-1] + 1), *main_args],
+            cwd=directory,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        elapsed = perf_counter() - start
+
+        with open(os.path.join(directory, "doi_list.csv")) as f:
+            published = sum(1 for line in f if line.strip())
+
+    zenodo_summary = zenodo.settings.summary()
+    zenodo.shutdown()
+    cedadocs.shutdown()
+
+    return {
+        "records": len(records),
+        "published": published,
+        "seconds": elapsed,
+        "records_per_min": published / elapsed * 60,
+        "uploaded_bytes_per_sec": zenodo_summary["bytes_received"] / elapsed,
+        "zenodo": zenodo_summary,
+        "cedadocs": cedadocs.settings.summary(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs main.py range mode against local fake servers. Unknown arguments are passed to main.py"
+    )
+    parser.add_argument("--records", type=int, default=100)
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of 5xx from Zenodo")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Zenodo requests per minute")
+    parser.add_argument("--body-rate", type=int, default=None, help="bytes/s of cedadocs response bodies")
+    args, main_args = parser.parse_known_args()
+
+    records = make_records(args.records)
+    # urls would be probed over the internet
+    for record in records:
+        record.pop("official_url", None)
+
+    result = run_load_test(
+        records,
+        args.file_size,
+        main_args,
+        Fake_settings(args.latency, args.error_rate, args.rate_limit),
+        Fake_settings(args.latency, body_rate=args.body_rate),
+    )
+    print(json.dumps(result, indent=2))
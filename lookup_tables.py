@@ -0,0 +1,116 @@
+import csv
+import os
+from threading import Lock
+
+DOI_FILE = "doi_list.csv"
+URL_FILE = "cedadocs official url updates - Sheet1.csv"
+
+
+def load_doi_map(path):
+    '''This function loads DOI identifiers of already uploaded records
+
+    Args:
+        path (str): Path to CSV file of record IDs and DOIs
+    '''
+    doi_map = dict()
+    with open(path) as csvfile:
+        reader = csv.reader(csvfile, delimiter=",")
+        for line in reader:
+            doi_map[int(line[0])] = line[1]
+    return doi_map
+
+
+def load_url_map(path):
+    '''This function loads file with correct urls to process mapping
+
+    Args:
+        path (str): Path to CSV file of urls, their statuses and alternative urls
+    '''
+    url_map = dict()
+    with open(path) as csvfile:
+        reader = csv.reader(csvfile, delimiter=",")
+        for line in reader:
+            url_map[line[2]] = [line[1], line[3], line[4]]
+    return url_map
+
+
+class Table_cache:
+    '''This class keeps lookup table loaded from a file once per process
+
+    File is loaded again only if its modification time has changed since the last load, missing file gives empty table.
+    Entries which have not been written to the file yet can be added as pending, they are kept over reloads.
+    Tables are shared by all users, so they must be treated as read-only
+    '''
+
+    def __init__(self, path, loader):
+        ''' Init method of the class
+
+        Args:
+            path (str): Path to the file with the table
+            loader (function): Function which loads table from the path
+        '''
+        self.path = path
+        self.loader = loader
+        self.lock = Lock()
+        self.mtime = None
+        self.table = None
+        self.pending = dict()
+
+    def get(self):
+        '''This method returns the table, reloading it if the file has changed
+
+        '''
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            # missing file gives empty table
+            mtime = 0
+
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    table = self.loader(self.path) if mtime else dict()
+                    table.update(self.pending)
+                    self.table = table
+                    self.mtime = mtime
+        return self.table
+
+    def add(self, key, value):
+        '''This method adds entry which has just been appended to the file by this process
+
+        Table is updated in place and its current modification time is remembered,
+        so the append does not cause a full reload
+
+        Args:
+            key: Key of the new entry
+            value: Value of the new entry
+        '''
+        self.update({key: value})
+
+    def add_pending(self, entries):
+        '''This method adds entries which will be appended to the file later (see update)
+
+        Args:
+            entries (dict): New entries
+        '''
+        with self.lock:
+            self.pending.update(entries)
+            if self.table is not None:
+                self.table.update(entries)
+
+    def update(self, entries):
+        '''This method adds entries which have just been appended to the file by this process (see add)
+
+        Args:
+            entries (dict): New entries
+        '''
+        with self.lock:
+            for key in entries:
+                self.pending.pop(key, None)
+            if self.table is not None:
+                self.table.update(entries)
+                self.mtime = os.stat(self.path).st_mtime_ns
+
+
+doi_table = Table_cache(DOI_FILE, load_doi_map)
+url_table = Table_cache(URL_FILE, load_url_map)
@@ -1,39 +1,457 @@
-from transfer_to_zenodo import Transfer_to_zenodo
-from time import sleep
+import argparse
 import sys
 
-if __name__ == "__main__":
-    # valid number of arguments is 1 or 2
-    if 3 < len(sys.argv) < 2:
-        print("Wrong number of arguments!")
-
-    # 2 arguments means processing records in range
-    if len(sys.argv) == 3:
-        id_list = []
-        with open("all_ids.txt") as f:
-            id_list = list(f)
-            id_list = [int(i) for i in id_list]
-
-        for i in id_list:
-            if int(sys.argv[1]) <= i < int(sys.argv[2]):
-                transfer_object = Transfer_to_zenodo(i)
-                transfer_object.get_record()
-                transfer_object.upload_to_zenodo()
-                sleep(3)
-                # commented out for testing
-                transfer_object.post_record()
-
-
-    # -2137 is a special code for cleaning upload service
-    elif int(sys.argv[1]) == -2137:
-        transfer_object = Transfer_to_zenodo(int(sys.argv[1]))
-        transfer_object.delete_records()
-    
-    # single argument means uploading single record
+# modules are imported by the commands which use them, so short commands start without
+# loading requests, the converter or the lookup tables
+
+
+def migrate_record(record_id, resume=False, record_publisher=None):
+    '''This function transfers and publishes a single record
+
+    It is run by every worker of the range mode, so it must not share any state with other calls
+
+    Args:
+        record_id (int): ID of cedadocs record
+        resume (bool): If True, continue from the state left by a previous run
+        record_publisher (Publisher): Stage publishing the record, it is published right away if not given
+    '''
+    from transfer_to_zenodo import Transfer_to_zenodo
+
+    transfer_object = Transfer_to_zenodo(record_id)
+    transfer_object.get_record()
+
+    # publish only records that have been uploaded successfully
+    if transfer_object.upload_to_zenodo(resume) == 0:
+        if record_publisher is None:
+            transfer_object.post_record()
+        else:
+            record_publisher.submit(transfer_object)
+
+
+def migrate_range(first_id, last_id, workers=1, resume=False, publishers=None):
+    '''This function transfers all records with `id` which pass the condition `first_id <= id < last_id`
+
+    Records already published according to the migration state are skipped.
+    Others are processed by a pool of `workers` threads, each of them running its own transfer pipeline.
+    Uploaded records are published by a separate pool of `publishers` threads
+
+    Args:
+        first_id (int): First ID of the range (inclusive)
+        last_id (int): Last ID of the range (exclusive)
+        workers (int): Number of records processed at the same time
+        resume (bool): If True, continue from the state left by a previous run
+        publishers (int): Number of depositions published at the same time (publisher.PUBLISHERS if not given)
+    '''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import http_session
+    import publisher
+    import transfer_to_zenodo
+    from migration_state import get_state
+
+    publishers = publishers or publisher.PUBLISHERS
+    id_list = get_state().pending_ids(first_id, last_id)
+
+    # every worker needs its own connection to each host for every file it uploads
+    http_session.configure(
+        pool_size=max(
+            http_session.POOL_SIZE, workers * transfer_to_zenodo.FILE_WORKERS + publishers
+        )
+    )
+
+    with publisher.Publisher(publishers) as record_publisher:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(migrate_record, i, resume, record_publisher): i
+                for i in id_list
+            }
+            for future in as_completed(futures):
+                # one broken record must not stop the whole batch
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Record {futures[future]} failed with {e!r}")
+
+
+def pipeline_range(
+    first_id,
+    last_id,
+    fetchers,
+    uploaders,
+    resume=False,
+    publishers=None,
+    export_source=None,
+):
+    '''This function transfers records in range `first_id <= id < last_id` using staged pipeline
+
+    If `export_source` is given, records are streamed from the bulk export instead of being fetched one by one
+
+    Args:
+        first_id (int): First ID of the range (inclusive)
+        last_id (int): Last ID of the range (exclusive)
+        fetchers (int): Number of threads fetching and converting records
+        uploaders (int): Number of threads uploading records to Zenodo
+        resume (bool): If True, continue from the state left by a previous run
+        publishers (int): Number of depositions published at the same time (publisher.PUBLISHERS if not given)
+        export_source (str): URL or path of the bulk JSON export
+    '''
+    import http_session
+    import pipeline
+    import publisher
+    import transfer_to_zenodo
+    from migration_state import get_state
+
+    publishers = publishers or publisher.PUBLISHERS
+    if export_source:
+        import bulk_export
+
+        id_list = bulk_export.pending_records(export_source, first_id, last_id)
+    else:
+        id_list = get_state().pending_ids(first_id, last_id)
+    http_session.configure(
+        pool_size=max(
+            http_session.POOL_SIZE,
+            fetchers + uploaders * transfer_to_zenodo.FILE_WORKERS + publishers,
+        )
+    )
+    pipeline.run_pipeline(
+        id_list, fetchers, uploaders, resume=resume, publishers=publishers
+    )
+
+
+def set_file_workers(file_workers):
+    '''This function sets number of files of a single record uploaded at the same time
+
+    '''
+    if file_workers:
+        import transfer_to_zenodo
+
+        transfer_to_zenodo.FILE_WORKERS = file_workers
+
+
+def command_migrate(args):
+    '''This function transfers and publishes a single record
+
+    '''
+    set_file_workers(args.file_workers)
+    try:
+        migrate_record(args.record_id, args.resume)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+
+def command_range(args):
+    '''This function transfers and publishes records in range `first <= id < last`
+
+    '''
+    set_file_workers(args.file_workers)
+    if args.fetchers or args.uploaders or args.bulk_export:
+        import pipeline
+
+        pipeline_range(
+            args.first,
+            args.last,
+            args.fetchers or pipeline.FETCHERS,
+            args.uploaders or pipeline.UPLOADERS,
+            args.resume,
+            args.publishers,
+            args.bulk_export,
+        )
+    else:
+        migrate_range(args.first, args.last, args.workers, args.resume, args.publishers)
+
+
+def command_publish(args):
+    '''This function publishes depositions uploaded earlier
+
+    '''
+    import publisher
+
+    publisher.publish_uploaded(
+        *id_range(args), workers=args.publishers or publisher.PUBLISHERS
+    )
+
+
+def command_sync(args):
+    '''This function updates Zenodo records of cedadocs records changed since the last sync
+
+    '''
+    import record_sync
+
+    summary = record_sync.sync(args.since, args.workers or record_sync.SYNC_WORKERS)
+    print(
+        f"{summary['updated']} records updated, {summary['unchanged']} unchanged, "
+        f"{summary['baselined']} baselined, {summary['failed']} failed, {summary['new']} new"
+    )
+    return 1 if summary["failed"] else 0
+
+
+def command_cleanup(args):
+    '''This function removes drafts left on Zenodo by the migration
+
+    '''
+    from transfer_to_zenodo import Transfer_to_zenodo
+
+    # drafts are not bound to any record, cleanup runs on a placeholder one
+    Transfer_to_zenodo(-2137).delete_records(args.dry_run)
+
+
+def command_convert(args):
+    '''This function converts records to Zenodo metadata without uploading them
+
+    '''
+    import bulk_convert
+
+    records = bulk_convert.iter_exports(args.path)
+    counter = bulk_convert.convert_records(
+        records,
+        args.output,
+        not args.skip_depositing_user,
+        args.workers or bulk_convert.CONVERT_WORKERS,
+    )
+    print(f"{counter} records converted")
+
+    if args.golden:
+        different = bulk_convert.compare_outputs(args.golden, args.output)
+        print(f"{len(different)} records different from {args.golden}: {different}")
+        return 1 if different else 0
+
+
+def command_report(args):
+    '''This function summarises a traced run
+
+    '''
+    import run_report
+
+    events = run_report.load_events(
+        args.trace_path or args.trace or run_report.TRACE_FILE, args.run_id
+    )
+    run_report.print_report(run_report.build_report(events))
+
+
+def command_import(args):
+    '''This function refills the state database from csv files
+
+    '''
+    from migration_state import get_state
+
+    get_state().import_csv()
+
+
+def command_export(args):
+    '''This function exports the state database to csv files
+
+    '''
+    from migration_state import get_state
+
+    get_state().export_csv()
+
+
+def command_index_urls(args):
+    '''This function resolves official urls of records before conversion
+
+    '''
+    import bulk_convert
+    import record_cache
+    import url_index
+
+    records = bulk_convert.iter_exports(args.path or record_cache.CACHE_DIR)
+    summary = url_index.build_index(records, refresh=args.refresh)
+    print(f"{summary['urls']} urls indexed, {summary['probed']} hosts probed, {summary['broken']} urls broken")
+
+
+def command_users(args):
+    '''This function resolves depositing users of records before conversion
+
+    '''
+    import depositing_user
+    from migration_state import get_state
+
+    counter = depositing_user.resolve_all(get_state().ids(*id_range(args)))
+    print(f"Depositing users of {counter} records resolved")
+
+
+def command_ingest(args):
+    '''This function reads bulk export, adding its records to the state and to the cache
+
+    '''
+    import bulk_export
+
+    counter = sum(1 for _ in bulk_export.ingest(*filter(None, [args.source])))
+    print(f"{counter} records ingested")
+
+
+def id_range(args):
+    '''This function returns optional range of IDs given to the command
+
+    '''
+    return [i for i in (args.first, args.last) if i is not None]
+
+
+def add_range(parser, required=True):
+    '''This function adds range of IDs `first <= id < last` to arguments of the command
+
+    '''
+    nargs = None if required else "?"
+    parser.add_argument("first", type=int, nargs=nargs, help="first ID of the range (inclusive)")
+    parser.add_argument("last", type=int, nargs=nargs, help="last ID of the range (exclusive)")
+
+
+def build_parser():
+    '''This function builds parser of command line arguments
+
+    Options shared by every command can be given before or after the name of the command
+    '''
+    from tracing import TRACE_FILE
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--offline", action="store_true", default=argparse.SUPPRESS,
+        help="take cedadocs responses only from the local cache",
+    )
+    common.add_argument(
+        "--trace", metavar="FILE", nargs="?", const=TRACE_FILE, default=argparse.SUPPRESS,
+        help=f"append trace events of every stage to the file ({TRACE_FILE} if not given), tracing is off by default",
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Migration of cedadocs records to Zenodo", parents=[common]
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    def add_command(name, function, help, *parents):
+        command = commands.add_parser(
+            name, parents=[common, *parents], help=help, description=help
+        )
+        command.set_defaults(function=function)
+        return command
+
+    # options of the commands which upload records
+    upload = argparse.ArgumentParser(add_help=False)
+    upload.add_argument(
+        "--resume", action="store_true", help="reuse depositions left by an interrupted run"
+    )
+    upload.add_argument(
+        "--file-workers", type=int, metavar="N",
+        help="number of files of a single record uploaded at the same time",
+    )
+
+    command = add_command("migrate", command_migrate, "transfer and publish a single record", upload)
+    command.add_argument("record_id", type=int, help="ID of cedadocs record")
+
+    command = add_command("range", command_range, "transfer and publish records in range", upload)
+    add_range(command)
+    command.add_argument(
+        "--workers", type=int, default=1, metavar="N", help="number of records processed at the same time"
+    )
+    command.add_argument(
+        "--fetchers", type=int, metavar="N", help="number of threads fetching records (staged pipeline)"
+    )
+    command.add_argument(
+        "--uploaders", type=int, metavar="N", help="number of threads uploading records (staged pipeline)"
+    )
+    command.add_argument(
+        "--publishers", type=int, metavar="N", help="number of depositions published at the same time"
+    )
+    command.add_argument(
+        "--bulk-export", metavar="SOURCE", help="stream records from bulk export at the url or path"
+    )
+
+    command = add_command("publish", command_publish, "publish depositions uploaded earlier")
+    add_range(command, required=False)
+    command.add_argument(
+        "--publishers", type=int, metavar="N", help="number of depositions published at the same time"
+    )
+
+    command = add_command("sync", command_sync, "update Zenodo records changed in cedadocs since the last sync")
+    command.add_argument(
+        "--since", metavar="YYYY-MM-DD", help="check records modified since the date instead of the last sync"
+    )
+    command.add_argument(
+        "--workers", type=int, metavar="N", help="number of records updated at the same time"
+    )
+
+    command = add_command("cleanup", command_cleanup, "remove drafts left on Zenodo by the migration")
+    command.add_argument(
+        "--dry-run", action="store_true", help="only list depositions which would be removed"
+    )
+
+    command = add_command("convert", command_convert, "convert records to Zenodo metadata")
+    command.add_argument("path", help="record cache, directory, archive or bulk export")
+    command.add_argument("output", help="JSON Lines file of converted records")
+    command.add_argument(
+        "--skip-depositing-user", action="store_true", help="leave depositing user out of metadata"
+    )
+    command.add_argument(
+        "--golden", metavar="FILE", help="compare converted records with output of an earlier conversion"
+    )
+    command.add_argument(
+        "--workers", type=int, metavar="N", help="number of processes converting records (one per core by default)"
+    )
+
+    command = add_command("report", command_report, "summarise a traced run")
+    command.add_argument("trace_path", nargs="?", metavar="trace", help="trace file (trace.jsonl by default)")
+    command.add_argument("run_id", nargs="?", help="ID of the run (the last one by default)")
+
+    add_command("import", command_import, "refill the state database from csv files")
+    add_command("export", command_export, "export the state database to csv files")
+
+    command = add_command("index-urls", command_index_urls, "resolve official urls before conversion")
+    command.add_argument("path", nargs="?", help="records to index (the record cache by default)")
+    command.add_argument("--refresh", action="store_true", help="probe every host of broken urls again")
+
+    command = add_command("users", command_users, "resolve depositing users before conversion")
+    add_range(command, required=False)
+
+    command = add_command("ingest", command_ingest, "add records of bulk export to the state and the cache")
+    command.add_argument("source", nargs="?", help="url or path of the export")
+
+    return parser
+
+
+def legacy_arguments(argv):
+    '''This function translates positional invocations of earlier versions into commands
+
+    `ID` becomes `migrate ID`, `FIRST LAST` becomes `range FIRST LAST` and `-2137` becomes `cleanup`
+    '''
+    def is_id(arg):
+        return arg.lstrip("-").isdigit()
+
+    if not argv or not is_id(argv[0]):
+        return argv
+    if argv[0] == "-2137":
+        return ["cleanup"] + argv[1:]
+    if len(argv) > 1 and is_id(argv[1]):
+        return ["range"] + argv
+    return ["migrate"] + argv
+
+
+def main(argv=None):
+    '''This function runs the command given on the command line
+
+    Returns:
+        int: Exit code
+    '''
+    parser = build_parser()
+    args = parser.parse_args(legacy_arguments(sys.argv[1:] if argv is None else argv))
+
+    if args.command in ["publish", "users"] and (args.first is None) != (args.last is None):
+        parser.error(f"{args.command} takes either both first and last ID or none")
+
+    if getattr(args, "offline", False):
+        import record_cache
+
+        record_cache.configure(offline=True)
+
+    if getattr(args, "trace", None):
+        import tracing
+
+        tracing.configure(args.trace)
     else:
-        transfer_object = Transfer_to_zenodo(int(sys.argv[1]))
-        transfer_object.get_record()
-        transfer_object.upload_to_zenodo()
+        args.trace = None
 
-        # commented out for testing
-        transfer_object.post_record()
+    return args.function(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
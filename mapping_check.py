@@ -0,0 +1,137 @@
+import copy
+import gzip
+import json
+import random
+import sys
+from benchmark import make_records
+from metadata_converter import Metadata_converter, metadata_hash
+
+# saved input records and their expected metadata, one JSON line {"record": ..., "metadata": ...} each
+GOLDEN_FILE = "mapping_golden.jsonl.gz"
+
+# number of synthetic records saved and number of variants of each with some optional fields changed
+RECORDS = 300
+VARIANTS = 2
+
+# fields every record has, the others are removed at random from variants
+REQUIRED_FIELDS = ["eprintid", "type", "documents", "title"]
+
+# lookup tables used instead of the ones of the current directory, so the output does not depend on them
+GOLDEN_DOIS = {7: "10.5281/zenodo.7", 8: "10.5281/zenodo.8"}
+GOLDEN_URL_INDEX = {
+    "http://www.example.org/kept": None,
+    "http://old.example.org/moved": "https://new.example.org/moved",
+}
+GOLDEN_URLS = ["http://www.example.org/kept", "HTTP://OLD.example.org/moved "]
+
+
+class Golden_converter(Metadata_converter):
+    '''This class is Metadata_converter with lookup tables and network calls replaced by the constant ones above
+
+    '''
+
+    def __init__(self, cedadocs_record):
+        super().__init__(cedadocs_record, offline=True)
+        self.doi_map = GOLDEN_DOIS
+        self.url_index = GOLDEN_URL_INDEX
+
+    def get_depositing_user(self):
+        return "Golden User"
+
+
+def make_variants(record, rng, variants=VARIANTS):
+    '''This function yields the record and its variants with optional fields removed or given unusual values
+
+    '''
+    yield record
+    for _ in range(variants):
+        variant = copy.deepcopy(record)
+        for field in list(variant):
+            if field not in REQUIRED_FIELDS and rng.random() < 0.3:
+                del variant[field]
+        if rng.random() < 0.3:
+            variant["funders"] = ["a", "b", "c"][:rng.randint(0, 3)]
+        if rng.random() < 0.2:
+            variant["output_media"] = rng.choice(["Internet", "CD"])
+        if rng.random() < 0.1:
+            variant["keywords"] = rng.choice(["a,,b; c.", "x\r\ny", ", ,"])
+        yield variant
+
+
+def golden_records(count=RECORDS, seed=0):
+    '''This function yields synthetic records of benchmark.py and their variants, shortened to keep the golden file small
+
+    Urls and earlier versions are taken from the constant tables above
+    '''
+    rng = random.Random(seed)
+    for record in make_records(count, seed):
+        record["abstract"] = " ".join(record["abstract"].split()[:30])
+        if "referencetext" in record:
+            record["referencetext"] = "\r\n".join(record["referencetext"].split("\r\n")[:3])
+        for field in ["creators", "editors", "contributors", "funders", "projects"]:
+            if field in record:
+                record[field] = record[field][:5]
+        record["documents"] = record["documents"][:3]
+
+        record.pop("official_url", None)
+        record.pop("succeeds", None)
+        if rng.random() < 0.5:
+            record["official_url"] = rng.choice(GOLDEN_URLS)
+        if rng.random() < 0.3:
+            record["succeeds"] = rng.choice([7, 8, 9])
+
+        yield from make_variants(record, rng)
+
+
+def convert(record):
+    '''This function returns metadata of the record, or name of the exception the conversion raised
+
+    '''
+    try:
+        return Golden_converter(copy.deepcopy(record)).get_metadata()
+    except Exception as e:
+        return type(e).__name__
+
+
+def save_golden(path=GOLDEN_FILE):
+    '''This function converts golden records and saves them with their metadata as the expected output
+
+    Returns:
+        int: Number of saved records
+    '''
+    counter = 0
+    with gzip.open(path, "wt") as f:
+        for record in golden_records():
+            f.write(json.dumps({"record": record, "metadata": convert(record)}) + "\n")
+            counter += 1
+    return counter
+
+
+def check_golden(path=GOLDEN_FILE):
+    '''This function converts saved records again and compares the output with the saved one
+
+    Metadata are compared by their hash (see metadata_hash), so transfer date in notes does not count
+
+    Returns:
+        tuple: Number of checked records and indices of records converted differently
+    '''
+    counter = 0
+    different = []
+    with gzip.open(path, "rt") as f:
+        for index, line in enumerate(f):
+            golden = json.loads(line)
+            counter += 1
+            if metadata_hash(convert(golden["record"])) != metadata_hash(golden["metadata"]):
+                different.append(index)
+    return counter, different
+
+
+if __name__ == "__main__":
+    # usage: python mapping_check.py [--update], --update saves the current output as the expected one
+    if sys.argv[1:] == ["--update"]:
+        print(f"{save_golden()} records saved to {GOLDEN_FILE}")
+        sys.exit(0)
+
+    counter, different = check_golden()
+    print(f"{counter} records checked, {len(different)} converted differently (lines of {GOLDEN_FILE}): {different}")
+    sys.exit(1 if different else 0)
@@ -0,0 +1,234 @@
+# Rules of the mapping from cedadocs records to Zenodo metadata expressed as data.
+# MAPPING_SPEC gathers all of them and is compiled once by Mapping_engine (metadata_converter.py)
+
+# those records needed to be mapped by hand
+TYPE_EXCEPTIONS = {
+    158: "publication/report",
+    1295: "other",
+    53: "image/photo",
+    55: "image/photo",
+    56: "image/photo",
+    150: "image/photo",
+    65: "image/figure",
+    91: "image/figure",
+    1287: "image/diagram",
+    1474: "image/diagram",
+    194: "presentation",
+    333: "poster",
+}
+
+TYPE_MAP = {
+    "article": "publication/article",
+    "book": "publication/book",
+    "book_section": "publication/section",
+    "conference_item": "other",
+    "conference_item/keynote": "presentation",
+    "conference_item/speech": "presentation",
+    "conference_item/lecture": "publication/conferencepaper",
+    "conference_item/paper": "publication/conferencepaper",
+    "conference_item/other": "publication/other",
+    "conference_item/poster": "poster",
+    "exhibition": "other",
+    "exhibition/speech": "presentation",
+    "image": "image",
+    "other": "other",
+    "teaching_resource": "lesson",
+    "video": "video",
+    "audio": "video",
+    "dataset": "dataset",
+    "monograph/working_paper": "publication/workingpaper",
+    "monograph/other": "other",
+    "monograph/structured_metadata": "other",
+    "monograph/discussion_paper": "publication/workingpaper",
+    "monograph/documentation": "other",
+    "monograph/manual": "publication/technicalnote",
+    "monograph/minutes": "publication/report",
+    "monograph/annual_report": "publication/report",
+    "monograph/project_report": "publication/report",
+    "monograph/technical_report": "publication/technicalnote",
+}
+
+# types which need additional attribute to determine Zenodo type, the attribute is required for 'monograph'
+SUBTYPE_FIELDS = {
+    "monograph": "monograph_type",
+    "conference_item": "pres_type",
+    "exhibition": "pres_type",
+}
+
+# subjects with no corresponding url are put into keywords
+KEYWORD_SUBJECTS = {
+    "biology_and_microbiology": "biology and microbiology",
+    "computer_science": "computer science",
+    "data_and_information": "data and information",
+    "ecology_and_environment": "ecology and environment",
+    "hist_of_science": "history of science",
+    "science_policy": "science policy",
+}
+
+# keywords of those records needed to be mapped by hand
+KEYWORD_EXCEPTIONS = {
+    150: ["radiosonde", "weather", "balloon", "clouds"],
+    274: [
+        "data quality",
+        "European Space Agency",
+        "ESA",
+    ],  # 'Data quality European Space Agency ESA'
+    341: [
+        "Doppler",
+        "LiDAR",
+        "Atmospheric Physics Turbulence",
+    ],  # 'Doppler lidar Atmospheric Physics Turbulence'
+    764: ["FAAM Website", "Airborne Measurements"],
+    785: [
+        "LiDAR",
+        "Volcanic Ash",
+        "EZlidar",
+        "UKMO",
+        "Technical Note",
+        "OBR",
+    ],  # 'LiDAR Volcanic Ash EZlidar UKMO Technical Note OBR'
+    810: [
+        "data holdings",
+        "NERC",
+        "SIS",
+        "dataset",
+        "CEDA",
+        "NEODC",
+        "BADC",
+        "UKSSDC",
+        "services",
+    ],  # data holdings NERC SIS dataset CEDA NEODC BADC UKSSDC services
+    899: ["metadata", "tools", "climate modelling"],
+    1313: ["MIPAS", "Cloud Retrieval Algorithm"],
+    1382: ["CMIP", "ESGF", "CF"],
+}
+
+# records in those ID ranges get the same keywords
+KEYWORD_RANGES = [
+    (range(823, 866), ["Environmental Physics Group", "Institute of Physics"]),
+    (range(913, 916), ["Environmental Physics Group", "Institute of Physics"]),
+]
+
+# the only record with 'skill_areas' instead of keywords gets those
+SKILL_AREAS_KEYWORDS = ["data management", "scientific computing"]
+
+# missing publishers
+IGNORED_PUBLISHERS = ["N/A", "Unknown", "unknown"]
+
+PUBLISHER_ACRONYMS = {
+    "ARSF-DAN": "Airborne Remote Sensing Facility Data Analysis Node (ARSF-DAN)",
+    "STFC": "Science and Technology Facilities Council (STFC)",
+    "STFC RAL": "Science and Technology Facilities Council; Rutherford Appleton Laboratory (STFC RAL)",
+    "BAS": "British Antarctic Survey (BAS)",
+    "ESRIN": "European Space Research Institute (ESRIN)",
+    "British Atmospheric Data Centre": "British Atmospheric Data Centre (BADC)",
+    "National Aeronautics and Space Administration": "National Aeronautics and Space Administration (NASA)",
+}
+
+# subjects with urls of their definitions
+SUBJECTS_BASE_URL = "https://id.loc.gov/authorities/subjects/"
+SUBJECTS_MAP = {
+    "archaeology": ["Archaeology", "sh85006507.html"],
+    "atmospheric_sciences": ["Atmospheric Sciences", "sh2018002590.html"],
+    "chemistry": ["Chemistry", "sh85022986.html"],
+    "earth_sciences": ["Earth Sciences", "sh85040468.html"],
+    "economics": ["Economics", "sh85040850.html"],
+    "education": ["Education", "sh85040989.html"],
+    "electronics": ["Electronics", "sh85042383.html"],
+    "glaciology": ["Glaciology", "sh85055077.html"],
+    "health": ["Health", "sh85059518.html"],
+    "hydrology": ["Hydrology", "sh85063458.html"],
+    "law": ["Law", "sh85075119.html"],
+    "management": ["Management", "sh85080336.html"],
+    "marine_sciences": ["Marine Sciences", "sh85081263.html"],
+    "mathematics": ["Mathematics", "sh85082139.html"],
+    "meteorology": ["Meteorology", "sh85084334.html"],
+    "physics": ["Physics", "sh85101653.html"],
+    "space_science": ["Space Science", "sh85125953.html"],
+}
+
+# fields mapped directly (as strings) in the order of Zenodo metadata: cedadocs field, Zenodo field
+SIMPLE_FIELDS = [
+    ("title", "title"),
+    ("abstract", "description"),
+    ("isbn", "imprint_isbn"),
+    ("event_dates", "conference_dates"),
+    ("event_location", "conference_place"),
+    ("event_title", "conference_title"),
+    ("book_title", "partof_title"),
+    ("place_of_pub", "imprint_place"),
+    ("number", "journal_issue"),
+    ("volume", "journal_volume"),
+    ("pagerange", "partof_pages"),
+]
+
+# missing fields which are filled with value of another Zenodo field
+SIMPLE_FIELD_FALLBACKS = {"description": "title"}
+
+# fields of every record
+CONSTANT_FIELDS = {
+    "language": "eng",
+    "communities": [{"identifier": "ceda-document-repository"}],
+}
+
+# people and institutions put into contributors: cedadocs field, whether it holds names of people, Zenodo type
+CONTRIBUTOR_FIELDS = [
+    ("contributors", True, "Other"),
+    ("editors", True, "Editor"),
+    ("corp_creators", False, "Other"),
+    ("copyright_holders", False, "RightsHolder"),
+]
+
+# fields put into additional notes: cedadocs field, text before the value, text after the value
+NOTE_FIELDS = [
+    ("contact_email", "Contact for resource:", ""),
+    ("event_type", "Event type:", ""),
+    ("id_number", "Related identifier for this resource:", ""),
+    ("pedagogic_type", "This work was part of a", ""),
+    ("date_type", "The publish date on this item was its original", " date"),
+    (
+        "official_url",
+        "This item was previously associated with content (as an official url) at:",
+        "",
+    ),
+    ("output_media", "Originally provided via", ""),
+    ("series", "This item was part of the", " series"),
+]
+
+# values which are not put into notes: field values starting with the prefix, field values equal to the value
+NOTE_SKIP_PREFIXES = {"id_number": "ISBN"}
+NOTE_SKIP_VALUES = {"output_media": "Internet"}
+
+# id_number with this prefix is an alternate identifier rather than a note
+ISBN_PREFIX = "ISBN"
+
+# text added to the title of the publication: record type, or 'monograph/' and monograph type
+PUBLICATION_SUFFIXES = {
+    "article": "",
+    "book": " book",
+    "monograph/documentation": " documentation",
+    "monograph/technical_report": " technical report",
+}
+
+MAPPING_SPEC = {
+    "type_exceptions": TYPE_EXCEPTIONS,
+    "types": TYPE_MAP,
+    "subtype_fields": SUBTYPE_FIELDS,
+    "simple_fields": SIMPLE_FIELDS,
+    "simple_field_fallbacks": SIMPLE_FIELD_FALLBACKS,
+    "constant_fields": CONSTANT_FIELDS,
+    "contributor_fields": CONTRIBUTOR_FIELDS,
+    "keyword_subjects": KEYWORD_SUBJECTS,
+    "keyword_exceptions": KEYWORD_EXCEPTIONS,
+    "keyword_ranges": KEYWORD_RANGES,
+    "skill_areas_keywords": SKILL_AREAS_KEYWORDS,
+    "note_fields": NOTE_FIELDS,
+    "note_skip_prefixes": NOTE_SKIP_PREFIXES,
+    "note_skip_values": NOTE_SKIP_VALUES,
+    "isbn_prefix": ISBN_PREFIX,
+    "publication_suffixes": PUBLICATION_SUFFIXES,
+    "subjects_base_url": SUBJECTS_BASE_URL,
+    "subjects": SUBJECTS_MAP,
+    "ignored_publishers": IGNORED_PUBLISHERS,
+    "publisher_acronyms": PUBLISHER_ACRONYMS,
+}
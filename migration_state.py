@@ -0,0 +1,592 @@
+import csv
+import os
+import sqlite3
+from datetime import datetime
+from threading import Lock
+
+STATE_DB = "migration_state.db"
+IDS_FILE = "all_ids.txt"
+DOI_FILE = "doi_list.csv"
+ERRORS_FILE = "errors.csv"
+
+ERRORS_HEADER = [
+    "record_id",
+    "datetime",
+    "creation_status_code",
+    "metadata_status_code",
+    "file_upload_status_code",
+    "file_which_caused_problem",
+]
+
+# record statuses
+PENDING = "pending"
+FAILED = "failed"
+UPLOADED = "uploaded"
+PUBLISHED = "published"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    record_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    deposition_id INTEGER,
+    bucket_url TEXT,
+    doi TEXT,
+    creation_status_code TEXT,
+    metadata_status_code TEXT,
+    file_upload_status_code TEXT,
+    file_which_caused_problem TEXT,
+    uploaded_at TEXT,
+    published_at TEXT,
+    updated_at TEXT,
+    lastmod TEXT,
+    synced_at TEXT,
+    metadata_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS records_status ON records (status);
+CREATE INDEX IF NOT EXISTS records_deposition ON records (deposition_id);
+CREATE TABLE IF NOT EXISTS files (
+    record_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    checksum TEXT NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    PRIMARY KEY (record_id, filename)
+);
+CREATE TABLE IF NOT EXISTS depositions (
+    deposition_id INTEGER PRIMARY KEY,
+    record_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    record_id INTEGER NOT NULL,
+    uploaded_at TEXT NOT NULL,
+    creation_status_code TEXT NOT NULL,
+    metadata_status_code TEXT NOT NULL,
+    file_upload_status_code TEXT NOT NULL,
+    file_which_caused_problem TEXT NOT NULL,
+    UNIQUE (
+        record_id,
+        uploaded_at,
+        creation_status_code,
+        metadata_status_code,
+        file_upload_status_code,
+        file_which_caused_problem
+    )
+);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# columns added to the records table after its first version, databases of earlier runs get them on open
+ADDED_COLUMNS = {
+    "lastmod": "TEXT",
+    "synced_at": "TEXT",
+    "metadata_hash": "TEXT",
+}
+
+# setting holding the time the last incremental sync started
+LAST_SYNC = "last_sync"
+
+_state = None
+_state_lock = Lock()
+
+
+def is_failed(*status_codes):
+    '''This function checks if any of logged upload steps failed
+
+    Steps which have not been run have empty status code, non-numeric codes (like 'checksum') mean failure
+
+    Args:
+        status_codes (str): Status codes of the steps as saved in errors.csv
+    '''
+    return any(
+        code and (not code.isdigit() or int(code) >= 300) for code in status_codes
+    )
+
+
+def deposition_id_from_doi(doi):
+    '''This function returns ID of Zenodo deposition the DOI has been registered for (or None)
+
+    Zenodo DOIs end with ID of the record, e.g. '10.5281/zenodo.1234', which is the ID of its deposition
+    '''
+    prefix, _, suffix = (doi or "").rpartition("zenodo.")
+    return int(suffix) if prefix and suffix.isdigit() else None
+
+
+class Migration_state:
+    '''This class stores migration state of every cedadocs record in SQLite database
+
+    Each record is identified by its cedadocs ID and keeps its status, Zenodo deposition, DOI,
+    status codes of the upload steps and timestamps. All methods are safe to call from many threads
+    '''
+
+    def __init__(self, path=STATE_DB):
+        ''' Init method of the class
+
+        Args:
+            path (str): Path to the database file
+        '''
+        self.path = path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(records)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE records ADD COLUMN {column} {column_type}")
+            # databases of earlier runs only kept the latest deposition and upload of every record,
+            # they start the histories
+            self.connection.execute(
+                "INSERT INTO depositions SELECT deposition_id, record_id, updated_at FROM records "
+                "WHERE deposition_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM depositions)"
+            )
+            self.connection.execute(
+                "INSERT INTO uploads SELECT record_id, uploaded_at, "
+                "COALESCE(creation_status_code, ''), COALESCE(metadata_status_code, ''), "
+                "COALESCE(file_upload_status_code, ''), COALESCE(file_which_caused_problem, '') "
+                "FROM records WHERE uploaded_at IS NOT NULL AND NOT EXISTS (SELECT 1 FROM uploads)"
+            )
+
+    @staticmethod
+    def now():
+        return datetime.now().isoformat(timespec="seconds")
+
+    def is_empty(self):
+        '''This method checks if any record has been imported yet
+
+        '''
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM records LIMIT 1").fetchone()
+        return row is None
+
+    def is_valid(self, record_id):
+        '''This method checks if record of given ID exists in cedadocs
+
+        Args:
+            record_id (int): ID of cedadocs record
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM records WHERE record_id = ?", (record_id,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, record_id):
+        '''This method returns state of a record as a dict (or None if record is unknown)
+
+        Args:
+            record_id (int): ID of cedadocs record
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM records WHERE record_id = ?", (record_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def update(self, record_id, **fields):
+        '''This method updates given columns of the record, adding the record if needed
+
+        Deposition given to the record is also added to the depositions of the migration (see add_deposition)
+
+        Args:
+            record_id (int): ID of cedadocs record
+            fields: Column values to be saved
+        '''
+        fields["updated_at"] = self.now()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        assignments = ", ".join(f"{c} = excluded.{c}" for c in fields)
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT INTO records (record_id, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT (record_id) DO UPDATE SET {assignments}",
+                (record_id, *fields.values()),
+            )
+        if fields.get("deposition_id") is not None:
+            self.add_deposition(record_id, fields["deposition_id"])
+
+    def add_deposition(self, record_id, deposition_id):
+        '''This method remembers deposition created by the migration
+
+        Record keeps only its latest deposition, this list keeps all of them, so drafts left
+        by earlier runs can still be found by cleanup
+
+        Args:
+            record_id (int): ID of cedadocs record
+            deposition_id (int): ID of Zenodo deposition
+        '''
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO depositions VALUES (?, ?, ?)",
+                (deposition_id, record_id, self.now()),
+            )
+
+    def add_ids(self, record_ids):
+        '''This method adds records of given IDs as pending, records already known are left as they are
+
+        Args:
+            record_ids (list): IDs of cedadocs records
+        '''
+        now = self.now()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO records (record_id, status, updated_at) VALUES (?, ?, ?)",
+                [(record_id, PENDING, now) for record_id in record_ids],
+            )
+
+    def ids(self, first_id=None, last_id=None, statuses=None):
+        '''This method returns sorted IDs of records in range `first_id <= id < last_id`
+
+        Args:
+            first_id (int): First ID of the range (inclusive), no lower limit if not given
+            last_id (int): Last ID of the range (exclusive), no upper limit if not given
+            statuses (list): Only records of those statuses are returned, if given
+        '''
+        query = "SELECT record_id FROM records WHERE 1"
+        args = []
+        if first_id is not None:
+            query += " AND record_id >= ?"
+            args.append(first_id)
+        if last_id is not None:
+            query += " AND record_id < ?"
+            args.append(last_id)
+        if statuses:
+            query += f" AND status IN ({', '.join('?' for _ in statuses)})"
+            args += statuses
+        query += " ORDER BY record_id"
+
+        with self.lock:
+            rows = self.connection.execute(query, args).fetchall()
+        return [row[0] for row in rows]
+
+    def pending_ids(self, first_id=None, last_id=None):
+        '''This method returns IDs of records in range which have not been published yet
+
+        '''
+        return self.ids(first_id, last_id, [PENDING, FAILED, UPLOADED])
+
+    def oldest_migration(self):
+        '''This method returns time the earliest published record was published (or uploaded, if it is not known)
+
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MIN(COALESCE(published_at, uploaded_at)) FROM records WHERE status = ?",
+                (PUBLISHED,),
+            ).fetchone()
+        return row[0]
+
+    def get_setting(self, name):
+        '''This method returns value of the setting (or None if it has not been set)
+
+        Args:
+            name (str): Name of the setting, e.g. LAST_SYNC
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM settings WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, name, value):
+        '''This method saves value of the setting
+
+        Args:
+            name (str): Name of the setting, e.g. LAST_SYNC
+            value (str): Value of the setting
+        '''
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings VALUES (?, ?)", (name, value)
+            )
+
+    def dois(self):
+        '''This method returns map of record ID to DOI of every published record
+
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT record_id, doi FROM records WHERE doi IS NOT NULL"
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def drafts(self):
+        '''This method returns map of deposition ID to record ID of every deposition created by the migration
+        which may be unpublished
+
+        Depositions replaced by later runs are included, only current depositions of published records are left out
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT depositions.deposition_id, depositions.record_id FROM depositions "
+                "LEFT JOIN records ON records.record_id = depositions.record_id "
+                "WHERE NOT (records.status IS ? AND records.deposition_id IS depositions.deposition_id)",
+                (PUBLISHED,),
+            ).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def forget_deposition(self, record_id, deposition_id):
+        '''This method forgets deposition which has been removed
+
+        If it was the current deposition of the record, record is marked as pending again
+
+        Args:
+            record_id (int): ID of cedadocs record
+            deposition_id (int): ID of the removed Zenodo deposition
+        '''
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM depositions WHERE deposition_id = ?", (deposition_id,)
+            )
+            row = self.connection.execute(
+                "SELECT deposition_id FROM records WHERE record_id = ?", (record_id,)
+            ).fetchone()
+        if row is None or row[0] != deposition_id:
+            return
+
+        self.update(
+            record_id, status=PENDING, deposition_id=None, bucket_url=None, metadata_hash=None
+        )
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM files WHERE record_id = ?", (record_id,))
+
+    def save_upload(self, log_variables, deposition_id=None, bucket_url=None, lastmod=None):
+        '''This method saves result of an upload in the format used by errors.csv
+
+        Record keeps the latest result, every result is also added to the upload history
+
+        Args:
+            log_variables (list): List of information about latest upload
+            deposition_id (int): ID of Zenodo deposition, if it has been created
+            bucket_url (str): URL of the deposition bucket, if it has been created
+            lastmod (str): Last modification of the uploaded cedadocs record, if it has been uploaded
+        '''
+        record_id, logged_at, creation, metadata, file_upload, file_name = log_variables
+        failed = is_failed(creation, metadata, file_upload)
+        uploaded_at = datetime.strptime(logged_at.strip('"'), "%d/%m/%Y %H:%M:%S").isoformat()
+        fields = dict()
+        if lastmod is not None:
+            fields["lastmod"] = lastmod
+        self.update(
+            int(record_id),
+            status=FAILED if failed else UPLOADED,
+            deposition_id=deposition_id,
+            bucket_url=bucket_url,
+            creation_status_code=creation,
+            metadata_status_code=metadata,
+            file_upload_status_code=file_upload,
+            file_which_caused_problem=file_name,
+            uploaded_at=uploaded_at,
+            **fields,
+        )
+        self.add_uploads([(int(record_id), uploaded_at, creation, metadata, file_upload, file_name)])
+
+    def add_uploads(self, uploads):
+        '''This method adds results of uploads to the upload history, results already there are skipped
+
+        Args:
+            uploads (list): Tuples of record ID, time of the upload (ISO format) and the status codes and
+                file name of errors.csv
+        '''
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO uploads VALUES (?, ?, ?, ?, ?, ?)", uploads
+            )
+
+    def uploads(self):
+        '''This method returns every saved upload result in the order they were saved, as dicts
+
+        '''
+        with self.lock:
+            rows = self.connection.execute("SELECT * FROM uploads ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def save_doi(self, record_id, doi):
+        '''This method marks record as published with given DOI
+
+        Args:
+            record_id (int): ID of cedadocs record
+            doi (str): DOI of published Zenodo record
+        '''
+        self.save_dois({record_id: doi})
+
+    def save_dois(self, dois):
+        '''This method marks many records as published in a single transaction
+
+        Args:
+            dois (dict): DOIs of published Zenodo records by cedadocs record ID
+        '''
+        now = self.now()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO records (record_id, status, doi, published_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (record_id) DO UPDATE SET "
+                "status = excluded.status, doi = excluded.doi, "
+                "published_at = excluded.published_at, updated_at = excluded.updated_at",
+                [(record_id, PUBLISHED, doi, now, now) for record_id, doi in dois.items()],
+            )
+
+    def save_file(self, record_id, filename, size, checksum):
+        '''This method saves checksum of a file uploaded to the deposition bucket
+
+        Args:
+            record_id (int): ID of cedadocs record
+            filename (str): Name of the file
+            size (int): Size of the file in bytes
+            checksum (str): Checksum in Zenodo format, e.g. 'md5:...'
+        '''
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (record_id, filename, size, checksum, self.now()),
+            )
+
+    def get_file_checksum(self, record_id, filename):
+        '''This method returns checksum saved when the file was uploaded (or None)
+
+        Args:
+            record_id (int): ID of cedadocs record
+            filename (str): Name of the file
+        '''
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT checksum FROM files WHERE record_id = ? AND filename = ?",
+                (record_id, filename),
+            ).fetchone()
+        return row[0] if row else None
+
+    def import_csv(self, ids_file=IDS_FILE, doi_file=DOI_FILE, errors_file=ERRORS_FILE):
+        '''This method loads state from files used before the database was introduced
+
+        Records already in the database keep everything the files do not contain (deposition, hashes, timestamps)
+
+        Args:
+            ids_file (str): File with all valid IDs, one per line
+            doi_file (str): CSV file of record IDs and DOIs
+            errors_file (str): CSV file of upload logs
+        '''
+        now = self.now()
+        rows = dict()
+        uploads = []
+
+        with open(ids_file) as f:
+            for line in f:
+                if line.strip():
+                    rows[int(line)] = {"status": PENDING}
+
+        # the latest log line of a record wins
+        with open(errors_file) if os.path.exists(errors_file) else open(os.devnull) as csvfile:
+            reader = csv.reader(csvfile, delimiter=",")
+            for line in reader:
+                if not line or line[0] == "record_id":
+                    continue
+                creation, metadata, file_upload, file_name = (line[2:] + [""] * 4)[:4]
+                failed = is_failed(creation, metadata, file_upload)
+                uploaded_at = datetime.strptime(line[1], "%d/%m/%Y %H:%M:%S").isoformat()
+                rows.setdefault(int(line[0]), {}).update(
+                    status=FAILED if failed else UPLOADED,
+                    creation_status_code=creation,
+                    metadata_status_code=metadata,
+                    file_upload_status_code=file_upload,
+                    file_which_caused_problem=file_name,
+                    uploaded_at=uploaded_at,
+                )
+                uploads.append((int(line[0]), uploaded_at, creation, metadata, file_upload, file_name))
+
+        with open(doi_file) if os.path.exists(doi_file) else open(os.devnull) as csvfile:
+            reader = csv.reader(csvfile, delimiter=",")
+            for line in reader:
+                rows.setdefault(int(line[0]), {}).update(
+                    status=PUBLISHED, doi=line[1], deposition_id=deposition_id_from_doi(line[1])
+                )
+
+        columns = [
+            "status",
+            "doi",
+            "deposition_id",
+            "creation_status_code",
+            "metadata_status_code",
+            "file_upload_status_code",
+            "file_which_caused_problem",
+            "uploaded_at",
+        ]
+        # only columns known from the files are updated, values missing from them are kept.
+        # Records only listed in all_ids.txt keep their status
+        assignments = ", ".join(
+            f"{c} = COALESCE(excluded.{c}, records.{c})" for c in columns if c != "status"
+        )
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT INTO records (record_id, {', '.join(columns)}, updated_at) "
+                f"VALUES (?, {', '.join('?' for _ in columns)}, ?) "
+                f"ON CONFLICT (record_id) DO UPDATE SET "
+                f"status = CASE WHEN excluded.status = '{PENDING}' THEN records.status ELSE excluded.status END, "
+                f"{assignments}, updated_at = excluded.updated_at",
+                [
+                    (record_id, *(row.get(c) for c in columns), now)
+                    for record_id, row in rows.items()
+                ],
+            )
+        self.add_uploads(uploads)
+
+    def export_csv(self, ids_file=IDS_FILE, doi_file=DOI_FILE, errors_file=ERRORS_FILE):
+        '''This method writes state to the files used before the database was introduced
+
+        errors.csv gets every upload log saved so far, in the order of the uploads
+
+        Args:
+            ids_file (str): File with all valid IDs, one per line
+            doi_file (str): CSV file of record IDs and DOIs
+            errors_file (str): CSV file of upload logs
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM records ORDER BY record_id"
+            ).fetchall()
+
+        with open(ids_file, "w") as f:
+            for row in rows:
+                f.write(f"{row['record_id']}\n")
+
+        with open(doi_file, "w") as f:
+            for row in rows:
+                if row["doi"]:
+                    f.write(f"{row['record_id']},{row['doi']}\n")
+
+        with open(errors_file, "w") as f:
+            f.write(",".join(ERRORS_HEADER) + "\n")
+            for upload in self.uploads():
+                uploaded_at = datetime.fromisoformat(upload["uploaded_at"])
+                f.write(
+                    ",".join(
+                        [
+                            str(upload["record_id"]),
+                            uploaded_at.strftime('"%d/%m/%Y %H:%M:%S"'),
+                            upload["creation_status_code"],
+                            upload["metadata_status_code"],
+                            upload["file_upload_status_code"],
+                            upload["file_which_caused_problem"],
+                        ]
+                    )
+                    + "\n"
+                )
+
+
+def get_state():
+    '''This function returns state shared by the whole program
+
+    On first use database is filled from all_ids.txt, doi_list.csv and errors.csv, if there are any
+    (IDs can be taken from a bulk export instead, see bulk_export.py)
+    '''
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = Migration_state()
+            if _state.is_empty() and os.path.exists(IDS_FILE):
+                _state.import_csv()
+        return _state
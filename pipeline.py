@@ -0,0 +1,127 @@
+from transfer_to_zenodo import Transfer_to_zenodo
+from publisher import Publisher, PUBLISHERS
+from queue import Queue
+from threading import Thread
+
+# number of threads of each stage and number of converted records waiting for upload
+FETCHERS = 2
+UPLOADERS = 4
+QUEUE_SIZE = 16
+
+
+def feed_stage(items, id_queue, fetchers):
+    '''This function puts IDs or records into `id_queue`, then a signal to stop for every fetcher
+
+    Args:
+        items (iterable): IDs of records or records themselves (e.g. streamed from a bulk export)
+        id_queue (Queue): Queue read by fetchers, it blocks when they fall behind
+        fetchers (int): Number of fetchers
+    '''
+    try:
+        for item in items:
+            id_queue.put(item)
+    except Exception as e:
+        print(f"Reading records failed with {e!r}")
+    finally:
+        for _ in range(fetchers):
+            id_queue.put(None)
+
+
+def fetch_stage(id_queue, record_queue):
+    '''This function fetches and converts records until it gets None
+
+    Records given instead of IDs are converted without being fetched.
+    Converted records are put into `record_queue`, which blocks when uploaders fall behind
+
+    Args:
+        id_queue (Queue): IDs of records (or records) to be processed
+        record_queue (Queue): Queue of Transfer_to_zenodo objects ready for upload
+    '''
+    while True:
+        item = id_queue.get()
+        if item is None:
+            return
+
+        record_id = item["eprintid"] if isinstance(item, dict) else item
+        try:
+            transfer_object = Transfer_to_zenodo(record_id)
+            if isinstance(item, dict):
+                transfer_object.cedadocs_record = item
+            else:
+                transfer_object.get_record()
+            transfer_object.convert_metadata()
+        except Exception as e:
+            print(f"Record {record_id} failed with {e!r}")
+            continue
+
+        record_queue.put(transfer_object)
+
+
+def upload_stage(record_queue, publisher, resume=False):
+    '''This function uploads converted records until it gets None, handing them over to the publisher
+
+    Args:
+        record_queue (Queue): Queue of Transfer_to_zenodo objects ready for upload
+        publisher (Publisher): Stage publishing uploaded depositions
+        resume (bool): If True, continue from the state left by a previous run
+    '''
+    while True:
+        transfer_object = record_queue.get()
+        if transfer_object is None:
+            return
+
+        try:
+            # publish only records that have been uploaded successfully
+            if transfer_object.upload_to_zenodo(resume) == 0:
+                publisher.submit(transfer_object)
+        except Exception as e:
+            print(f"Record {transfer_object.record_id} failed with {e!r}")
+
+
+def run_pipeline(
+    id_list,
+    fetchers=FETCHERS,
+    uploaders=UPLOADERS,
+    queue_size=QUEUE_SIZE,
+    resume=False,
+    publishers=PUBLISHERS,
+):
+    '''This function transfers records using separate stages for cedadocs and Zenodo
+
+    Fetchers get and convert upcoming records while uploaders send earlier ones to Zenodo
+    and publishers publish the uploaded ones, so waiting for cedadocs is hidden behind uploads
+
+    Args:
+        id_list (iterable): IDs of records to be transferred, or records themselves
+        fetchers (int): Number of threads fetching and converting records
+        uploaders (int): Number of threads uploading records to Zenodo
+        queue_size (int): Maximum number of records waiting for conversion and converted records waiting for upload
+        resume (bool): If True, continue from the state left by a previous run
+        publishers (int): Number of depositions published at the same time
+    '''
+    id_queue = Queue(maxsize=queue_size)
+    record_queue = Queue(maxsize=queue_size)
+
+    feed_thread = Thread(target=feed_stage, args=(id_list, id_queue, fetchers))
+    feed_thread.start()
+
+    fetch_threads = [
+        Thread(target=fetch_stage, args=(id_queue, record_queue))
+        for _ in range(fetchers)
+    ]
+    with Publisher(publishers) as publisher:
+        upload_threads = [
+            Thread(target=upload_stage, args=(record_queue, publisher, resume))
+            for _ in range(uploaders)
+        ]
+        for thread in fetch_threads + upload_threads:
+            thread.start()
+
+        # once every record is fetched, each uploader gets a signal to stop
+        feed_thread.join()
+        for thread in fetch_threads:
+            thread.join()
+        for _ in upload_threads:
+            record_queue.put(None)
+        for thread in upload_threads:
+            thread.join()
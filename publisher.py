@@ -0,0 +1,147 @@
+from transfer_to_zenodo import Transfer_to_zenodo, register_dois, append_dois
+from migration_state import get_state, UPLOADED
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+# number of depositions published at the same time and number of DOIs appended to doi_list.csv at once
+PUBLISHERS = 4
+BATCH_SIZE = 100
+
+
+class Publisher:
+    '''This class publishes uploaded depositions on its own pool of threads
+
+    Uploaders only hand depositions over, so they can continue with the next records.
+    DOI of every published record is saved to the migration state and the DOI map at once, so records
+    converted later can refer to it. Only appends to doi_list.csv are done in batches of `batch_size`,
+    the rest when the publisher is closed.
+
+    Record which succeeds a record whose DOI is not known yet is held back until its predecessor is published
+    (or fails), then its metadata are converted again. Records still held back when the publisher
+    is closed are published as they are. It is used as a context manager
+    '''
+
+    def __init__(self, workers=PUBLISHERS, batch_size=BATCH_SIZE):
+        ''' Init method of the class
+
+        Args:
+            workers (int): Number of depositions published at the same time
+            batch_size (int): Number of DOIs appended to doi_list.csv at once
+        '''
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batch_size = batch_size
+        self.condition = Condition()
+        self.dois = dict()
+        self.waiting = dict()
+        self.active = 0
+        self.published = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def submit(self, transfer_object):
+        '''This method queues uploaded deposition for publishing, or holds it back until its predecessor is published
+
+        Args:
+            transfer_object (Transfer_to_zenodo): Record whose upload_to_zenodo has succeeded
+        '''
+        # DOIs are registered before successors are released under the same lock, so none is missed
+        with self.condition:
+            predecessor = transfer_object.waiting_for()
+            if predecessor is not None:
+                print(f"Record {transfer_object.record_id} waits for record {predecessor} to be published")
+                self.waiting.setdefault(predecessor, []).append(transfer_object)
+                return
+            self.start(transfer_object)
+
+    def start(self, transfer_object):
+        '''This method puts deposition into the pool, it must be called with the lock held
+
+        '''
+        self.active += 1
+        self.executor.submit(self.publish, transfer_object)
+
+    def publish(self, transfer_object):
+        '''This method publishes a single deposition, registers its DOI and releases records waiting for it
+
+        '''
+        doi = None
+        try:
+            if transfer_object.refresh_metadata():
+                doi = transfer_object.publish()
+            if doi:
+                register_dois({transfer_object.record_id: doi})
+        except Exception as e:
+            print(f"Record {transfer_object.record_id} failed with {e!r}")
+
+        # successors of a failed record are published without reference to it
+        with self.condition:
+            for successor in self.waiting.pop(transfer_object.record_id, []):
+                self.start(successor)
+            if doi:
+                self.dois[transfer_object.record_id] = doi
+                self.published += 1
+            full = len(self.dois) >= self.batch_size
+            self.active -= 1
+            self.condition.notify_all()
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''This method appends DOIs collected so far to doi_list.csv
+
+        '''
+        with self.condition:
+            dois, self.dois = self.dois, dict()
+        if dois:
+            append_dois(dois)
+
+    def close(self):
+        '''This method waits for queued depositions, publishes the ones still held back and saves the remaining DOIs
+
+        '''
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.active == 0)
+                # records waiting for a held back record are released when it is published
+                held_ids = {t.record_id for waiting in self.waiting.values() for t in waiting}
+                predecessors = [p for p in self.waiting if p not in held_ids] or list(self.waiting)
+                held_back = [t for p in predecessors for t in self.waiting.pop(p)]
+                for transfer_object in held_back:
+                    self.start(transfer_object)
+            if not held_back:
+                break
+
+        self.executor.shutdown(wait=True)
+        self.flush()
+
+
+def publish_uploaded(first_id=None, last_id=None, workers=PUBLISHERS):
+    '''This function publishes every uploaded but unpublished deposition in range `first_id <= id < last_id`
+
+    Depositions are taken from the migration state, so it can be run after uploads of any earlier run
+
+    Args:
+        first_id (int): First ID of the range (inclusive), no lower limit if not given
+        last_id (int): Last ID of the range (exclusive), no upper limit if not given
+        workers (int): Number of depositions published at the same time
+
+    Returns:
+        int: Number of published records
+    '''
+    state = get_state()
+    with Publisher(workers) as publisher:
+        for record_id in state.ids(first_id, last_id, [UPLOADED]):
+            deposition_id = state.get(record_id)["deposition_id"]
+            if not deposition_id:
+                continue
+            transfer_object = Transfer_to_zenodo(record_id)
+            transfer_object.deposition_id = deposition_id
+            publisher.submit(transfer_object)
+
+    print(f"{publisher.published} records published")
+    return publisher.published
@@ -0,0 +1,141 @@
+from email.utils import parsedate_to_datetime
+from threading import Condition
+from time import monotonic, time
+
+# requests per second at start and limits of its adjustment
+RATE = 2.0
+MIN_RATE = 0.1
+MAX_RATE = 20.0
+# number of requests which can be sent at once
+BURST = 5
+# requests in flight at start and upper limit of their number
+CONCURRENCY = 4
+MAX_CONCURRENCY = 32
+# pause in seconds after 429 status code without any hint from the server
+BACKOFF = 10
+
+
+class Rate_limiter:
+    '''This class limits rate and concurrency of requests sent to one server
+
+    Rate is controlled by a token bucket. Both rate and number of requests in flight
+    grow slowly after every success and are halved after 429 status code (AIMD).
+    Retry-After and X-RateLimit-* headers pause the limiter or cap its rate,
+    so requests are spread over what is left of the server's window
+    '''
+
+    def __init__(self, rate=RATE, concurrency=CONCURRENCY, max_concurrency=MAX_CONCURRENCY):
+        ''' Init method of the class
+
+        Args:
+            rate (float): Initial number of requests per second
+            concurrency (int): Initial number of requests in flight
+            max_concurrency (int): Maximum number of requests in flight
+        '''
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.header_rate = None
+
+        self.tokens = 1.0
+        self.updated = monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.condition = Condition()
+
+    def current_rate(self):
+        '''This method returns rate allowed both by AIMD and by rate limit headers
+
+        '''
+        if self.header_rate is None:
+            return self.rate
+        return max(MIN_RATE, min(self.rate, self.header_rate))
+
+    def refill(self, now):
+        self.tokens = min(BURST, self.tokens + (now - self.updated) * self.current_rate())
+        self.updated = now
+
+    def acquire(self):
+        '''This method blocks until a request can be sent
+
+        Returns:
+            float: Number of seconds the request has waited, 0.0 if it has not waited at all
+        '''
+        started = None
+        with self.condition:
+            while True:
+                now = monotonic()
+                self.refill(now)
+
+                if now < self.paused_until:
+                    timeout = self.paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    timeout = None
+                elif self.tokens < 1:
+                    timeout = (1 - self.tokens) / self.current_rate()
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return 0.0 if started is None else now - started
+
+                if started is None:
+                    started = now
+                self.condition.wait(timeout)
+
+    def release(self, response=None):
+        '''This method marks request as finished and adjusts limits to its response
+
+        Args:
+            response (requests.Response): Response of the request, None if it failed without one
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            if response is not None:
+                self.update(response)
+            self.condition.notify_all()
+
+    def update(self, response):
+        now = monotonic()
+        headers = response.headers
+
+        if response.status_code == 429:
+            # multiplicative decrease
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.concurrency = max(1, self.concurrency / 2)
+            pause = self.get_retry_after(headers)
+            self.paused_until = max(self.paused_until, now + pause)
+        else:
+            # additive increase
+            self.rate = min(MAX_RATE, self.rate + 1 / self.rate)
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+
+        window = max(float(reset) - time(), 1.0)
+        if int(remaining) <= 0:
+            self.paused_until = max(self.paused_until, now + window)
+        else:
+            self.header_rate = int(remaining) / window
+
+    @staticmethod
+    def get_retry_after(headers):
+        '''This method returns number of seconds the server asked to wait for
+
+        '''
+        retry_after = headers.get("Retry-After")
+        if retry_after is not None:
+            if retry_after.isdigit():
+                return float(retry_after)
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time())
+            except (TypeError, ValueError):
+                pass
+
+        reset = headers.get("X-RateLimit-Reset")
+        if reset is not None:
+            return max(0.0, float(reset) - time())
+
+        return BACKOFF
@@ -0,0 +1,302 @@
+import os
+import sqlite3
+from hashlib import sha1
+from threading import Lock
+from time import time
+
+# can be overridden, e.g. to run against a local fake server
+CEDADOCS_URL = os.environ.get("CEDADOCS_URL", "http://cedadocs.ceda.ac.uk/")
+
+CACHE_DIR = ".cache/cedadocs"
+# total size of cached bodies, least recently used ones are removed above it
+MAX_SIZE = 2 * 1024**3
+# entries younger than this (in seconds) are used without asking the server
+MAX_AGE = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    record_id INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+CREATE INDEX IF NOT EXISTS entries_record_id ON entries (record_id);
+"""
+
+_cache = None
+_cache_lock = Lock()
+_settings = dict()
+
+
+def export_url(record_id):
+    '''This function returns url of JSON export of a single cedadocs record
+
+    '''
+    return f"{CEDADOCS_URL}cgi/export/eprint/{record_id}/JSON/ceda-eprint-{record_id}.js"
+
+
+class Cache_miss(Exception):
+    '''Raised in offline mode when requested url is not cached'''
+
+
+class Fetch_error(Exception):
+    '''Raised when the server answers with status code other than 200 and the caller needs a valid body'''
+
+    def __init__(self, url, status_code):
+        super().__init__(f"{url} answered with status code {status_code}")
+        self.status_code = status_code
+
+
+class Record_cache:
+    '''This class keeps responses of cedadocs (JSON exports and record pages) on the disk
+
+    Entries are keyed by url and tagged with record ID. Stale entries are revalidated with
+    ETag/Last-Modified headers, and least recently used ones are removed when cache exceeds its size.
+    In offline mode network is never used
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_size=MAX_SIZE, max_age=MAX_AGE, offline=False):
+        ''' Init method of the class
+
+        Args:
+            directory (str): Directory where cached bodies and index are stored
+            max_size (int): Maximum total size of cached bodies in bytes
+            max_age (int): Age in seconds after which entry is revalidated
+            offline (bool): If True, only cached entries are returned
+        '''
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.offline = offline
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(directory, "index.db"), check_same_thread=False
+        )
+        self.connection.row_factory = sqlite3.Row
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+            self.size = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+
+    @staticmethod
+    def get_key(url):
+        return sha1(url.encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f"{key}.body")
+
+    def get_entry(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def read_body(self, entry):
+        '''This method reads cached body and marks entry as recently used
+
+        Returns None if body has been removed from the disk
+        '''
+        try:
+            with open(self.get_path(entry["key"]), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE entries SET used_at = ? WHERE key = ?", (time(), entry["key"])
+            )
+        return body
+
+    def store(self, key, url, record_id, response):
+        '''This method saves body of the response and its validators
+
+        '''
+        return self.store_body(
+            key,
+            url,
+            record_id,
+            response.content,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    def store_body(self, key, url, record_id, body, etag=None, last_modified=None):
+        '''This method saves body of given url, e.g. taken from a bulk export instead of a response
+
+        Args:
+            key (str): Key of the url, see get_key
+            url (str): Address of the resource
+            record_id (int): ID of cedadocs record the resource belongs to
+            body (bytes): Body of the resource
+            etag (str): ETag header of the response, if any
+            last_modified (str): Last-Modified header of the response, if any
+        '''
+        path = self.get_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(body)
+        os.replace(temp_path, path)
+
+        now = time()
+        with self.lock, self.connection:
+            old = self.connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    record_id,
+                    etag,
+                    last_modified,
+                    len(body),
+                    now,
+                    now,
+                ),
+            )
+            self.size += len(body) - (old[0] if old else 0)
+        self.evict()
+        return body
+
+    def evict(self):
+        '''This method removes least recently used entries until cache fits its size
+
+        '''
+        with self.lock, self.connection:
+            while self.size > self.max_size:
+                row = self.connection.execute(
+                    "SELECT key, size FROM entries ORDER BY used_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+                try:
+                    os.remove(self.get_path(row[0]))
+                except FileNotFoundError:
+                    pass
+                self.size -= row[1]
+
+    def fetch(self, url, record_id=None, offline=None, max_age=None, raise_errors=False):
+        '''This method returns body of given url, using the cache whenever possible
+
+        Only successful responses are cached, others are returned without being saved (or raise Fetch_error)
+
+        Args:
+            url (str): Address of the resource
+            record_id (int): ID of cedadocs record the resource belongs to
+            offline (bool): Overrides offline mode of the cache for this call, if given
+            max_age (int): Overrides age after which entry is revalidated for this call, if given
+            raise_errors (bool): If True, responses other than 200 raise Fetch_error instead of being returned
+        '''
+        key = self.get_key(url)
+        entry = self.get_entry(key)
+        body = self.read_body(entry) if entry else None
+
+        if self.offline if offline is None else offline:
+            if body is None:
+                raise Cache_miss(url)
+            return body
+
+        if max_age is None:
+            max_age = self.max_age
+        if body is not None and time() - entry["fetched_at"] < max_age:
+            return body
+
+        # ask server if cached body is still valid
+        headers = dict()
+        if body is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        # requests is imported only by processes which really download records
+        from http_session import get_session
+
+        r = get_session().get(url, headers=headers)
+
+        if r.status_code == 304 and body is not None:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "UPDATE entries SET fetched_at = ? WHERE key = ?", (time(), key)
+                )
+            return body
+
+        if r.status_code == 200:
+            return self.store(key, url, record_id, r)
+
+        if raise_errors:
+            raise Fetch_error(url, r.status_code)
+        return r.content
+
+    def cached(self, url_part=""):
+        '''This method yields (record ID, body) of cached entries whose url contains given text
+
+        Entries are sorted by record ID
+
+        Args:
+            url_part (str): Text which url of the entry must contain
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, record_id FROM entries WHERE instr(url, ?) ORDER BY record_id",
+                (url_part,),
+            ).fetchall()
+        for key, record_id in rows:
+            try:
+                with open(self.get_path(key), "rb") as f:
+                    yield record_id, f.read()
+            except FileNotFoundError:
+                continue
+
+    def invalidate(self, record_id):
+        '''This method removes every cached entry of given record
+
+        Args:
+            record_id (int): ID of cedadocs record
+        '''
+        with self.lock, self.connection:
+            rows = self.connection.execute(
+                "SELECT key, size FROM entries WHERE record_id = ?", (record_id,)
+            ).fetchall()
+            for key, size in rows:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.remove(self.get_path(key))
+                except FileNotFoundError:
+                    pass
+                self.size -= size
+
+
+def configure(**settings):
+    '''This function sets options of the shared cache (see Record_cache for their names)
+
+    It should be called before the cache is used for the first time
+    '''
+    global _cache
+    with _cache_lock:
+        _settings.update(settings)
+        _cache = None
+
+
+def get_cache():
+    '''This function returns cache shared by the whole program, creating it on first use
+
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = Record_cache(**_settings)
+        return _cache
@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from http_session import get_session
+from migration_state import get_state, PUBLISHED, LAST_SYNC
+from record_cache import CEDADOCS_URL
+from transfer_to_zenodo import Transfer_to_zenodo, get_lastmod
+
+# OAI-PMH interface of cedadocs, lists records modified since given date, can be overridden
+OAI_URL = os.environ.get("CEDADOCS_OAI_URL", f"{CEDADOCS_URL}cgi/oai2")
+OAI_NAMESPACES = {"oai": "http://www.openarchives.org/OAI/2.0/"}
+
+# number of records updated at the same time
+SYNC_WORKERS = 4
+
+# results of sync_record
+UNCHANGED = "unchanged"
+UPDATED = "updated"
+BASELINED = "baselined"
+SYNC_FAILED = "failed"
+
+
+def list_changed(since=None):
+    '''This function yields IDs of cedadocs records modified since given date, as listed by OAI-PMH
+
+    Only identifiers are listed, page by page, so records themselves are not downloaded
+
+    Args:
+        since (str): Date in format 'YYYY-MM-DD', every record is listed if not given
+
+    Yields:
+        tuple: ID of the record and True if it has been deleted
+    '''
+    params = {"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"}
+    if since:
+        params["from"] = since
+
+    while True:
+        r = get_session().get(OAI_URL, params=params)
+        r.raise_for_status()
+        root = ElementTree.fromstring(r.content)
+
+        oai_error = root.find("oai:error", OAI_NAMESPACES)
+        if oai_error is not None:
+            if oai_error.get("code") == "noRecordsMatch":
+                return
+            raise ValueError(f"OAI-PMH error {oai_error.get('code')}: {oai_error.text}")
+
+        listing = root.find("oai:ListIdentifiers", OAI_NAMESPACES)
+        for header in listing.findall("oai:header", OAI_NAMESPACES):
+            # identifiers look like 'oai:cedadocs.ceda.ac.uk:123'
+            identifier = header.findtext("oai:identifier", namespaces=OAI_NAMESPACES)
+            yield int(identifier.rsplit(":", 1)[1]), header.get("status") == "deleted"
+
+        token = listing.findtext("oai:resumptionToken", namespaces=OAI_NAMESPACES)
+        if not token:
+            return
+        params = {"verb": "ListIdentifiers", "resumptionToken": token}
+
+
+def is_changed(lastmod, record_state):
+    '''This function checks if cedadocs record has been modified since it was migrated or last synced
+
+    Records migrated before modifications were saved are compared with the time they were published
+
+    Args:
+        lastmod (str): Last modification of the record, e.g. '2020-01-30 13:28:58'
+        record_state (dict): State of the record
+
+    Returns:
+        bool: True if record has changed, None if it cannot be told
+    '''
+    if record_state["lastmod"]:
+        return lastmod != record_state["lastmod"]
+
+    migrated_at = record_state["published_at"] or record_state["uploaded_at"]
+    if not migrated_at or not lastmod:
+        return None
+    return datetime.fromisoformat(lastmod) > datetime.fromisoformat(migrated_at)
+
+
+def sync_record(record_id):
+    '''This function updates published Zenodo record if its cedadocs record has been modified
+
+    Record is revalidated with cedadocs rather than taken from the cache as it is. Records which
+    cannot be compared only have their last modification saved, so the next sync compares them
+
+    Args:
+        record_id (int): ID of cedadocs record
+
+    Returns:
+        str: UNCHANGED, UPDATED, BASELINED or SYNC_FAILED
+    '''
+    transfer_object = Transfer_to_zenodo(record_id)
+    transfer_object.get_record(max_age=0)
+    lastmod = get_lastmod(transfer_object.cedadocs_record)
+
+    changed = is_changed(lastmod, transfer_object.state.get(record_id))
+    if changed is None:
+        transfer_object.state.update(record_id, lastmod=lastmod)
+        return BASELINED
+    if not changed:
+        return UNCHANGED
+
+    return UPDATED if transfer_object.update_on_zenodo() else SYNC_FAILED
+
+
+def sync(since=None, workers=SYNC_WORKERS):
+    '''This function updates Zenodo records whose cedadocs records have changed since the last sync
+
+    Records modified since the last successful sync (or since the earliest migration, on the first sync)
+    are listed by OAI-PMH and only published ones among them are compared and updated, `workers` at the same time.
+    New records are added to the migration state as pending, to be migrated by range mode
+
+    Args:
+        since (str): Date in format 'YYYY-MM-DD' overriding the start of the listing
+        workers (int): Number of records updated at the same time
+
+    Returns:
+        dict: Number of records by result of sync_record, and of new and deleted records
+    '''
+    state = get_state()
+    started_at = state.now()
+
+    if since is None:
+        last_sync = state.get_setting(LAST_SYNC) or state.oldest_migration()
+        # a day earlier, as cedadocs may keep dates in a different time zone
+        if last_sync:
+            since = (datetime.fromisoformat(last_sync) - timedelta(days=1)).date().isoformat()
+
+    published, new, deleted = [], [], []
+    for record_id, is_deleted in list_changed(since):
+        record_state = state.get(record_id)
+        if is_deleted:
+            deleted.append(record_id)
+        elif record_state is None:
+            new.append(record_id)
+        elif record_state["status"] == PUBLISHED:
+            published.append(record_id)
+    state.add_ids(new)
+    print(f"{len(published)} published records to check, {len(new)} new records, {len(deleted)} deleted records")
+
+    def sync_one(record_id):
+        # one broken record must not stop the whole sync
+        try:
+            return sync_record(record_id)
+        except Exception as e:
+            print(f"Record {record_id} failed with {e!r}")
+            return SYNC_FAILED
+
+    summary = {UNCHANGED: 0, UPDATED: 0, BASELINED: 0, SYNC_FAILED: 0}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(sync_one, published):
+            summary[result] += 1
+
+    # failed records are listed again by the next sync
+    if not summary[SYNC_FAILED]:
+        state.set_setting(LAST_SYNC, started_at)
+
+    if deleted:
+        print(f"Records deleted from cedadocs (their Zenodo records are kept): {deleted}")
+    return {**summary, "new": len(new), "deleted": len(deleted)}
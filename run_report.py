@@ -0,0 +1,128 @@
+import json
+from tracing import TRACE_FILE
+
+# stages in the order in which a record goes through them
+STAGES = [
+    "source_fetch",
+    "conversion",
+    "depositing_user",
+    "url_probe",
+    "deposition_create",
+    "metadata_put",
+    "file_verify",
+    "file_transfer",
+    "publish",
+    "doi_fetch",
+    "rate_limit_wait",
+]
+
+
+def load_events(path=TRACE_FILE, run=None):
+    '''This function reads trace events of a single run
+
+    Args:
+        path (str): Path to the trace file
+        run (str): ID of the run, the latest run in the file if not given
+    '''
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+
+    if run is None and events:
+        run = events[-1]["run"]
+    return [e for e in events if e["run"] == run]
+
+
+def is_failed(event):
+    '''This function checks if traced stage failed: it raised, got no response or got an error status code
+
+    Stages which do not send requests have no status code at all
+    '''
+    if "error" in event:
+        return True
+    if "status_code" not in event:
+        return False
+    return event["status_code"] is None or event["status_code"] >= 300
+
+
+def percentile(values, p):
+    '''This function returns p-th percentile (nearest rank) of sorted values
+
+    '''
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def build_report(events):
+    '''This function aggregates trace events into latency percentiles and throughput of every stage
+
+    Args:
+        events (list): Trace events of a single run
+
+    Returns:
+        dict: Summary of the run and statistics of every stage
+    '''
+    if not events:
+        return {"run": None, "stages": {}}
+
+    stages = dict()
+    for event in events:
+        stages.setdefault(event["stage"], []).append(event)
+
+    stage_report = dict()
+    for name in sorted(stages, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        stage_events = stages[name]
+        durations = sorted(e["duration"] for e in stage_events)
+        total = sum(durations)
+        transferred = sum(e.get("bytes", 0) for e in stage_events)
+        failed = sum(1 for e in stage_events if is_failed(e))
+        stage_report[name] = {
+            "count": len(stage_events),
+            "failed": failed,
+            "total_s": total,
+            "mean_s": total / len(durations),
+            "p50_s": percentile(durations, 50),
+            "p90_s": percentile(durations, 90),
+            "p99_s": percentile(durations, 99),
+            "max_s": durations[-1],
+            "bytes": transferred,
+            "bytes_per_s": transferred / total if total else 0.0,
+        }
+
+    start = min(e["start"] for e in events)
+    end = max(e["start"] + e["duration"] for e in events)
+    wall = max(end - start, 1e-9)
+    published = {e["record_id"] for e in stages.get("publish", []) if not is_failed(e)}
+    transferred = sum(e.get("bytes", 0) for e in stages.get("file_transfer", []))
+
+    return {
+        "run": events[0]["run"],
+        "wall_s": wall,
+        "records": len({e["record_id"] for e in events if e["record_id"] is not None}),
+        "published": len(published),
+        "records_per_min": len(published) / wall * 60,
+        "file_bytes_per_s": transferred / wall,
+        "stages": stage_report,
+    }
+
+
+def print_report(report):
+    '''This function prints report in a readable table
+
+    '''
+    if report["run"] is None:
+        print("No trace events")
+        return
+
+    print(f"Run {report['run']}: {report['records']} records, {report['published']} published in {report['wall_s']:.1f} s")
+    print(f"{report['records_per_min']:.1f} records/min, {report['file_bytes_per_s'] / 1e6:.2f} MB/s of files\n")
+    print(f"{'stage':18} {'count':>6} {'failed':>6} {'total s':>9} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'max s':>8} {'MB/s':>7}")
+    for name, s in report["stages"].items():
+        print(
+            f"{name:18} {s['count']:6} {s['failed']:6} {s['total_s']:9.2f} {s['p50_s']:8.3f} "
+            f"{s['p90_s']:8.3f} {s['p99_s']:8.3f} {s['max_s']:8.3f} {s['bytes_per_s'] / 1e6:7.2f}"
+        )
@@ -0,0 +1,100 @@
+import json
+import os
+from datetime import datetime
+from threading import Lock
+from time import perf_counter, time
+
+# default trace file, tracing is off until a file is given to configure
+TRACE_FILE = "trace.jsonl"
+
+# every process writes events of its own run
+RUN_ID = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+_trace_file = None
+_trace_path = None
+_trace_lock = Lock()
+
+
+class Stage:
+    '''This class measures duration of a single stage of the migration and saves it as trace event
+
+    It is used as a context manager. Fields of the event (e.g. status code or number of bytes)
+    can be added to the dict returned by `with`. Failed stages get 'error' field
+    '''
+
+    def __init__(self, stage, record_id=None, **fields):
+        ''' Init method of the class
+
+        Args:
+            stage (str): Name of the stage, e.g. 'source_fetch'
+            record_id (int): ID of cedadocs record the stage belongs to
+            fields: Extra fields of the event
+        '''
+        self.fields = {"run": RUN_ID, "stage": stage, "record_id": record_id, **fields}
+
+    def __enter__(self):
+        self.fields["start"] = time()
+        self.start = perf_counter()
+        return self.fields
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fields["duration"] = perf_counter() - self.start
+        if exc_value is not None:
+            self.fields["error"] = repr(exc_value)
+        save_event(self.fields)
+        return False
+
+
+def trace(stage, record_id=None, **fields):
+    '''This function returns context manager measuring given stage (see Stage)
+
+    '''
+    return Stage(stage, record_id, **fields)
+
+
+def save_measured(stage, start, duration, record_id=None, **fields):
+    '''This function saves event of a stage measured by the caller, e.g. waiting reported by the rate limiter
+
+    Args:
+        stage (str): Name of the stage, e.g. 'rate_limit_wait'
+        start (float): Time the stage started (as given by time.time)
+        duration (float): Duration of the stage in seconds
+        record_id (int): ID of cedadocs record the stage belongs to
+        fields: Extra fields of the event
+    '''
+    save_event(
+        {"run": RUN_ID, "stage": stage, "record_id": record_id, **fields, "start": start, "duration": duration}
+    )
+
+
+def save_event(event):
+    '''This function appends event to the trace file as a JSON line, if tracing is on
+
+    Args:
+        event (dict): Trace event
+    '''
+    global _trace_file
+    # checked without the lock, so untraced runs do not contend for it
+    if _trace_path is None:
+        return
+    line = json.dumps(event) + "\n"
+    with _trace_lock:
+        if _trace_path is None:
+            return
+        if _trace_file is None:
+            _trace_file = open(_trace_path, "a", buffering=1)
+        _trace_file.write(line)
+
+
+def configure(path=TRACE_FILE):
+    '''This function changes trace file, None turns tracing off
+
+    Args:
+        path (str): Path to the JSON Lines file events are appended to
+    '''
+    global _trace_file, _trace_path
+    with _trace_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+        _trace_file = None
+        _trace_path = path
@@ -1,15 +1,47 @@
 from logging import error
-from time import sleep
-import requests
 import json
-from metadata_converter import Metadata_converter
+import requests
+import os
+from urllib.parse import urlsplit
+from metadata_converter import Metadata_converter, metadata_hash
+from http_session import get_session, limit_host, MAX_RETRIES
+from rate_limiter import Rate_limiter
+from file_stream import File_stream
+from migration_state import get_state, is_failed, deposition_id_from_doi
+from lookup_tables import doi_table
+from record_cache import get_cache, export_url
+from tracing import trace
 from datetime import datetime
+from time import sleep
+from threading import Lock, Event
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 BASE_URL = "https://sandbox.zenodo.org/" 
 BASE_URL = 'https://zenodo.org/'
 ACCESS_TOKEN =  "*********" #my sandbox key
 ACCESS_TOKEN = '**********' #ceda zenodo key
 
+# both can be overridden, e.g. to run against a local fake server
+BASE_URL = os.environ.get("ZENODO_URL", BASE_URL)
+ACCESS_TOKEN = os.environ.get("ZENODO_TOKEN", ACCESS_TOKEN)
+
+# every call to Zenodo shares one adaptive rate limit
+limit_host(urlsplit(BASE_URL).netloc, Rate_limiter())
+
+# number of files of a single deposition uploaded at the same time
+FILE_WORKERS = 4
+
+# number of depositions listed at once and removed at the same time during cleanup
+CLEANUP_PAGE_SIZE = 100
+CLEANUP_WORKERS = 8
+
+# number of times a published deposition is fetched waiting for its DOI, first wait in seconds (doubled every time)
+DOI_POLLS = 5
+DOI_BACKOFF = 1
+
+# guards appends to errors.csv and doi_list.csv when records are processed in parallel
+LOG_LOCK = Lock()
+
 class Transfer_to_zenodo:
     '''This class is responsible for transferring records from Cedadocs to Zenodo
     '''
@@ -19,32 +51,96 @@ class Transfer_to_zenodo:
         
         Args:
             record_id (int): ID of cedadocs record
+
+        Raises:
+            ValueError: If there is no cedadocs record of given ID
         '''
 
-        # get valid ids from file
-        self.list_of_valid_ids = []
-        with open("all_ids.txt") as f:
-            self.list_of_valid_ids = list(f)
-            self.list_of_valid_ids = [int(i) for i in self.list_of_valid_ids]
+        # valid ids are kept in the migration state
+        self.state = get_state()
 
-        if record_id not in self.list_of_valid_ids and record_id != -2137:
-            error(f"Id {record_id} is invalid!")
-            exit(1)
+        # raised rather than exiting, as records are also processed by worker threads
+        if record_id != -2137 and not self.state.is_valid(record_id):
+            raise ValueError(f"Id {record_id} is invalid!")
 
         self.record_id = record_id
         self.ACCESS_TOKEN = ACCESS_TOKEN
         self.params = {"access_token": self.ACCESS_TOKEN}
+        self.session = get_session()
+        self.metadata = None
+        # size and checksum of source files read by read_source, by file name
+        self.source_files = dict()
 
-    def get_record(self):
+    def get_record(self, max_age=None):
         '''This method gets cedadocs record of given ID
 
+        Record is served from the local cache if it is still valid
+
+        Args:
+            max_age (int): Age in seconds after which cached record is revalidated, the cache default if not given
         '''
-        r = requests.get(
-            f"http://cedadocs.ceda.ac.uk/cgi/export/eprint/{self.record_id}/JSON/ceda-eprint-{self.record_id}.js"
+        with trace("source_fetch", self.record_id) as event:
+            record = get_cache().fetch(
+                export_url(self.record_id), self.record_id, max_age=max_age
+            )
+            event["bytes"] = len(record)
+        self.cedadocs_record = json.loads(record)
+
+    def convert_metadata(self):
+        '''This method converts metadata of the record fetched by get_record to Zenodo format
+
+        '''
+        with trace("conversion", self.record_id):
+            metadata_converter = Metadata_converter(self.cedadocs_record)
+            self.metadata = metadata_converter.get_metadata()
+
+    def get_files(self):
+        '''This method returns files of all documents of the record fetched by get_record
+
+        '''
+        return [file for doc in self.cedadocs_record["documents"] for file in doc["files"]]
+
+    def find_deposition(self):
+        '''This method returns Zenodo deposition saved in the migration state for this record
+
+        Records published before depositions were saved (e.g. imported from doi_list.csv) have
+        their deposition found by DOI, and it is saved for the next time.
+        None is returned if there is no such deposition or it no longer exists on Zenodo
+        '''
+        record_state = self.state.get(self.record_id)
+        if not record_state:
+            return None
+        dep_id = record_state["deposition_id"] or deposition_id_from_doi(record_state["doi"])
+        if not dep_id:
+            return None
+
+        r = self.session.get(
+            f"{BASE_URL}api/deposit/depositions/{dep_id}",
+            params=self.params,
         )
-        self.cedadocs_record = r.json()
+        if r.status_code != 200:
+            return None
+        if not record_state["deposition_id"]:
+            self.state.update(
+                self.record_id, deposition_id=dep_id, bucket_url=r.json()["links"]["bucket"]
+            )
+        return r.json()
+
+    def get_bucket_files(self, bucket_url):
+        '''This method returns files already present in the deposition bucket
 
-    def upload_to_zenodo(self):
+        Args:
+            bucket_url (str): URL of the deposition bucket
+
+        Returns:
+            dict: Bucket objects (with 'size' and 'checksum') by file name
+        '''
+        r = self.session.get(bucket_url, params=self.params)
+        if r.status_code != 200:
+            return {}
+        return {f["key"]: f for f in r.json().get("contents", [])}
+
+    def upload_to_zenodo(self, resume=False):
         '''This method transfers record to the Zenodo
 
         Process is splitted into 3 major parts:
@@ -54,7 +150,15 @@ class Transfer_to_zenodo:
 
         If any of steps fails the whole process is aborted
         Logs are saved to the errors.csv
-        
+
+        In resume mode deposition left by a previous run is reused, only missing files are uploaded
+        and deposition is kept (not removed) when any step fails
+
+        Args:
+            resume (bool): If True, continue from the state left by a previous run
+
+        Returns:
+            int: 0 on success, 1 if record turned out to be published already, negative on failure
         '''
 
         # log variables are initialize
@@ -68,149 +172,682 @@ class Transfer_to_zenodo:
             "",
         ]
 
-        # convert metadata
-        metadata_converter = Metadata_converter(self.cedadocs_record)
-        metadata = metadata_converter.get_metadata()
+        # convert metadata, unless it has been done in advance
+        if self.metadata is None:
+            self.convert_metadata()
+        metadata = self.metadata
 
         print(f'Uploading record {self.cedadocs_record["eprintid"]}')
 
-        # create deposition folder
-        creation_response = requests.post(
-            f"{BASE_URL}api/deposit/depositions",
-            params=self.params,
-            json={},
-        )
-        print(
-            f"Creation of new record finished with status code {creation_response.status_code}"
-        )
+        deposition = self.find_deposition() if resume else None
+        existing_files = dict()
 
-        # save status code
-        log_variables[2] = str(creation_response.status_code)
+        # published record only needs its DOI to be saved
+        if deposition and deposition["submitted"]:
+            print(f"Record already published as deposition {deposition['id']}")
+            self.deposition_id = deposition["id"]
+            self.save_doi(deposition["doi"])
+            return 1
 
-        # if fail - save logs and exit
-        if creation_response.status_code >= 300:
-            self.save_logs(log_variables)
-            return -1
+        if deposition:
+            dep_id = deposition["id"]
+            bucket_url = deposition["links"]["bucket"]
+            existing_files = self.get_bucket_files(bucket_url)
+            print(f"Reusing deposition {dep_id} with {len(existing_files)} files")
+
+        else:
+            # create deposition folder
+            with trace("deposition_create", self.record_id) as event:
+                creation_response = self.session.post(
+                    f"{BASE_URL}api/deposit/depositions",
+                    params=self.params,
+                    json={},
+                )
+                event["status_code"] = creation_response.status_code
+            print(
+                f"Creation of new record finished with status code {creation_response.status_code}"
+            )
 
-        # save deposition id and record url
-        dep_id = creation_response.json()["id"]
-        bucket_url = creation_response.json()["links"]["bucket"]
+            # save status code
+            log_variables[2] = str(creation_response.status_code)
 
-        # upload metadata
-        metadata_response = requests.put(
-            f"{BASE_URL}api/deposit/depositions/{dep_id}",
-            params=self.params,
-            data=json.dumps(metadata),
-            headers={"Content-Type": "application/json"},
-        )
+            # if fail - save logs and exit
+            if creation_response.status_code >= 300:
+                self.save_logs(log_variables)
+                return -1
 
-        print(
-            f"Uploading metadata finished with status code {metadata_response.status_code}"
-        )
+            # save deposition id and record url
+            dep_id = creation_response.json()["id"]
+            bucket_url = creation_response.json()["links"]["bucket"]
 
-        # save status code
-        log_variables[3] = str(metadata_response.status_code)
+            # draft is remembered at once, so an interrupted run can reuse it
+            self.state.update(self.record_id, deposition_id=dep_id, bucket_url=bucket_url)
 
-        # if fail - save logs and exit
-        if metadata_response.status_code >= 300:
-            print(f'\n{metadata_response.text}\n')
-            requests.delete(
+        # upload metadata, unless the reused deposition already has the same ones
+        if deposition and self.is_metadata_saved():
+            print("Metadata has not changed, it is not uploaded again")
+
+        else:
+            metadata_response = self.put_metadata(dep_id)
+
+            print(
+                f"Uploading metadata finished with status code {metadata_response.status_code}"
+            )
+
+            # save status code
+            log_variables[3] = str(metadata_response.status_code)
+
+            # if fail - save logs and exit
+            if metadata_response.status_code >= 300:
+                print(f'\n{metadata_response.text}\n')
+                self.abort_upload(log_variables, dep_id, bucket_url, resume)
+                return -2
+
+            self.state.update(self.record_id, metadata_hash=metadata_hash(self.metadata))
+
+        # upload files
+        failed_file = self.upload_files(self.get_files(), bucket_url, existing_files)
+
+        # if any file fail - save logs and exit
+        if failed_file:
+            filename, status_code = failed_file
+            print(f"Unexpected status code {status_code} on file {filename}")
+            log_variables[4] = str(status_code)
+            log_variables[5] = filename
+            self.abort_upload(log_variables, dep_id, bucket_url, resume)
+            return -1
+
+        print("\nEnd of record. Success!\n")
+        self.deposition_id = dep_id
+        self.save_logs(log_variables, dep_id, bucket_url, get_lastmod(self.cedadocs_record))
+        return 0
+
+    def put_metadata(self, dep_id):
+        '''This method uploads converted metadata to the deposition
+
+        Args:
+            dep_id (int): ID of Zenodo deposition
+
+        Returns:
+            Response of the Zenodo
+        '''
+        with trace("metadata_put", self.record_id) as event:
+            metadata_response = self.session.put(
                 f"{BASE_URL}api/deposit/depositions/{dep_id}",
                 params=self.params,
+                data=json.dumps(self.metadata),
+                headers={"Content-Type": "application/json"},
             )
-            print("Deposition will be removed from Zenodo")
-            self.save_logs(log_variables)
-            return -2
+            event["status_code"] = metadata_response.status_code
+        return metadata_response
 
-        # upload files
-        counter = 0
-        for doc in self.cedadocs_record["documents"]:
-            for file in doc["files"]:
-                 
-                # sleep to avoid 429 status code
-                if counter == 30:
-                    sleep(3)
-                    counter = 0
-                filename = file["filename"]
-                filepath = file["uri"]
-                counter += 1
-                file_response = requests.put(
-                    f"{bucket_url}/{filename}",
-                    data=requests.get(filepath).content,
-                    params=self.params,
-                )
-                # if any file fail - save logs and exit
-                if file_response.status_code >= 300:
-                    print(
-                        f"Unexpected status code {file_response.status_code} on file {filename}"
-                    )
-                    log_variables[4] = str(file_response.status_code)
-                    log_variables[5] = filename
-                    self.save_logs(log_variables)
-                    requests.delete(
-                        f"{BASE_URL}api/deposit/depositions/{dep_id}",
+    def is_metadata_saved(self):
+        '''This method checks if converted metadata are the same as the ones last saved on Zenodo for this record
+
+        Metadata are compared by their hash (see metadata_hash), so transfer date in notes does not count
+        '''
+        record_state = self.state.get(self.record_id)
+        return bool(record_state) and record_state["metadata_hash"] == metadata_hash(self.metadata)
+
+    def deposition_action(self, dep_id, action):
+        '''This method runs action of the Zenodo deposition API, e.g. 'edit', 'discard' or 'newversion'
+
+        Args:
+            dep_id (int): ID of Zenodo deposition
+            action (str): Name of the action
+
+        Returns:
+            Response of the Zenodo
+        '''
+        with trace(f"deposition_{action}", self.record_id) as event:
+            r = self.session.post(
+                f"{BASE_URL}api/deposit/depositions/{dep_id}/actions/{action}",
+                params=self.params,
+            )
+            event["status_code"] = r.status_code
+        print(f"Action {action} of deposition {dep_id} finished with status code {r.status_code}")
+        return r
+
+    def files_changed(self, deposition):
+        '''This method checks if files of the record differ from the files of its published deposition
+
+        Files are compared by name, by size if cedadocs gives it and finally by MD5 checksum of the source file,
+        so a file whose content has changed but whose size has not is found as well
+
+        Args:
+            deposition (dict): Published Zenodo deposition of the record
+        '''
+        published = {f["filename"]: f for f in deposition.get("files", [])}
+        files = self.get_files()
+        if set(published) != {f["filename"] for f in files}:
+            return True
+        if any(
+            f.get("filesize") is not None and f["filesize"] != published[f["filename"]]["filesize"]
+            for f in files
+        ):
+            return True
+        # deposition files have checksum without the 'md5:' prefix of bucket objects
+        return any(
+            self.read_source(f)[1] != f'md5:{published[f["filename"]]["checksum"]}' for f in files
+        )
+
+    def update_on_zenodo(self):
+        '''This method brings published deposition up to date with the record fetched by get_record
+
+        If only metadata have changed, deposition is edited, gets new metadata and is published again
+        (its DOI stays the same). If files have changed, new version of the deposition is published instead.
+        If neither have changed, nothing is sent to the Zenodo
+
+        Returns:
+            str: DOI of the updated Zenodo record (None if update failed)
+        '''
+        if self.metadata is None:
+            self.convert_metadata()
+
+        deposition = self.find_deposition()
+        if not deposition or not deposition["submitted"]:
+            error(f"Record {self.record_id} has no published deposition")
+            return None
+
+        metadata_changed = not self.is_metadata_saved()
+        if self.files_changed(deposition):
+            print(f"Files of record {self.record_id} have changed, publishing new version")
+            doi = self.new_version(deposition, metadata_changed)
+        elif metadata_changed:
+            print(f"Updating metadata of record {self.record_id}")
+            doi = self.edit_deposition(deposition)
+        else:
+            print(f"Metadata and files of record {self.record_id} have not changed")
+            doi = deposition["doi"]
+
+        if doi:
+            self.state.update(
+                self.record_id,
+                lastmod=get_lastmod(self.cedadocs_record),
+                synced_at=self.state.now(),
+                metadata_hash=metadata_hash(self.metadata),
+            )
+        return doi
+
+    def edit_deposition(self, deposition):
+        '''This method replaces metadata of published deposition and publishes it again
+
+        If anything fails, the edit is discarded and the published version stays as it was
+
+        Args:
+            deposition (dict): Published Zenodo deposition of the record
+
+        Returns:
+            str: DOI of the Zenodo record (None if update failed)
+        '''
+        dep_id = deposition["id"]
+        if self.deposition_action(dep_id, "edit").status_code >= 300:
+            return None
+
+        metadata_response = self.put_metadata(dep_id)
+        print(f"Uploading metadata finished with status code {metadata_response.status_code}")
+        if metadata_response.status_code < 300:
+            self.deposition_id = dep_id
+            doi = self.publish()
+            if doi:
+                return doi
+
+        self.deposition_action(dep_id, "discard")
+        return None
+
+    def new_version(self, deposition, metadata_changed=True):
+        '''This method publishes new version of the deposition with current metadata and files of the record
+
+        Files which have been removed from the record, or whose content has changed (compared by MD5 checksum
+        of the source file), are removed from the new version, missing ones are uploaded. If anything fails,
+        the new version is removed
+
+        Args:
+            deposition (dict): Published Zenodo deposition of the record
+            metadata_changed (bool): If False, metadata copied from the previous version are kept
+
+        Returns:
+            str: DOI of the new version (None if update failed)
+        '''
+        r = self.deposition_action(deposition["id"], "newversion")
+        if r.status_code >= 300:
+            return None
+
+        draft_response = self.session.get(r.json()["links"]["latest_draft"], params=self.params)
+        if draft_response.status_code != 200:
+            error(f"New version of record {self.record_id} has not been found")
+            return None
+        dep_id = draft_response.json()["id"]
+        bucket_url = draft_response.json()["links"]["bucket"]
+        # draft is remembered at once, so cleanup finds it if it cannot be removed
+        self.state.add_deposition(self.record_id, dep_id)
+
+        # files are copied from the previous version, only the ones with the same content as the source are kept.
+        # Checksums saved for the previous version are not trusted, the source may have changed since
+        files = {f["filename"]: f for f in self.get_files()}
+        existing_files = dict()
+        for key, existing in self.get_bucket_files(bucket_url).items():
+            if key in files and self.is_file_uploaded(files[key], existing, verify_source=True):
+                existing_files[key] = existing
+            else:
+                self.session.delete(f"{bucket_url}/{key}", params=self.params)
+        files = list(files.values())
+
+        doi = None
+        metadata_saved = not metadata_changed or self.put_metadata(dep_id).status_code < 300
+        if metadata_saved and not self.upload_files(files, bucket_url, existing_files):
+            self.deposition_id = dep_id
+            doi = self.publish()
+
+        if not doi:
+            print("New version will be removed from Zenodo")
+            self.delete_deposition(dep_id)
+            return None
+
+        self.state.update(self.record_id, deposition_id=dep_id, bucket_url=bucket_url)
+        self.save_doi(doi)
+        return doi
+
+    def upload_files(self, files, bucket_url, existing_files=None):
+        '''This method uploads files to the bucket, FILE_WORKERS files at the same time
+
+        After the first failure no more files are started, files in progress are finished
+
+        Args:
+            files (list): Files of the record (dicts with 'filename' and 'uri')
+            bucket_url (str): URL of the deposition bucket
+            existing_files (dict): Objects already present in the bucket by file name
+
+        Returns:
+            tuple: (filename, status code) of the file which failed, None if all succeeded.
+                Status code is the name of the exception if the file failed without a response
+        '''
+        existing_files = existing_files or dict()
+        stop = Event()
+
+        def upload(file):
+            if stop.is_set():
+                return None
+            # broken connection fails the file like an error status code, so the upload is aborted as usual
+            try:
+                return self.upload_file(file, bucket_url, existing_files.get(file["filename"]))
+            except Exception as e:
+                print(f"File {file['filename']} failed with {e!r}")
+                return type(e).__name__
+
+        failed_file = None
+        with ThreadPoolExecutor(max_workers=FILE_WORKERS) as executor:
+            futures = {executor.submit(upload, file): file["filename"] for file in files}
+            try:
+                for future in as_completed(futures):
+                    status_code = future.result()
+                    if status_code is None:
+                        continue
+                    if is_failed(str(status_code)):
+                        if failed_file is None:
+                            failed_file = (futures[future], status_code)
+                        stop.set()
+                        continue
+                    print(f"File {futures[future]} uploaded")
+            finally:
+                # files which have not started yet are skipped
+                stop.set()
+                for future in futures:
+                    future.cancel()
+
+        return failed_file
+
+    def upload_file(self, file, bucket_url, existing=None):
+        '''This method streams file from cedadocs straight to the bucket
+
+        MD5 checksum is computed on the way and compared with the one reported by the bucket.
+        Stream cannot be sent again, so after 429 status code or wrong checksum the file is opened again
+
+        Args:
+            file (dict): File of the record (with 'filename' and 'uri')
+            bucket_url (str): URL of the deposition bucket
+            existing (dict): Object of the same name already present in the bucket, if any
+
+        Returns:
+            Status code of the upload, 'checksum' if file kept arriving corrupted, None if file was already in the bucket
+        '''
+        filename = file["filename"]
+
+        if existing is not None and self.is_file_uploaded(file, existing):
+            print(f"File {filename} already uploaded")
+            return None
+
+        for _ in range(MAX_RETRIES + 1):
+            with trace("file_transfer", self.record_id, file=filename) as event:
+                with self.session.get(
+                    file["uri"], stream=True, headers={"Accept-Encoding": "identity"}
+                ) as source_response:
+                    stream = File_stream(source_response)
+                    file_response = self.session.put(
+                        f"{bucket_url}/{filename}",
+                        data=stream,
                         params=self.params,
                     )
-                    print("Deposition will be removed from Zenodo")
-                    return -1
+                event["status_code"] = file_response.status_code
+                event["bytes"] = stream.bytes_read
 
-                print(f"File {filename} uploaded")
-          
+            if file_response.status_code == 429:
+                status_code = 429
+                continue
+            if file_response.status_code >= 300:
+                return file_response.status_code
 
-        print("\nEnd of record. Success!\n")
-        self.deposition_id = dep_id
+            # bucket reports checksum of what it has received
+            if file_response.json().get("checksum") != stream.checksum:
+                print(f"Checksum of file {filename} does not match, it will be sent again")
+                status_code = "checksum"
+                continue
+
+            self.state.save_file(self.record_id, filename, stream.bytes_read, stream.checksum)
+            return file_response.status_code
+
+        return status_code
+
+    def is_file_uploaded(self, file, existing, verify_source=False):
+        '''This method checks if file present in the bucket is the same as the source file
+
+        Checksum saved when the file was uploaded is used if possible (unless `verify_source` is True),
+        otherwise the source is read (but not uploaded) to compute its checksum
+
+        Args:
+            file (dict): File of the record (with 'filename' and 'uri')
+            existing (dict): Object of the same name present in the bucket
+            verify_source (bool): If True, source is always read, e.g. when the record has changed since the upload
+        '''
+        if not verify_source:
+            checksum = self.state.get_file_checksum(self.record_id, file["filename"])
+            if checksum is not None:
+                return checksum == existing["checksum"]
+
+        size, checksum = self.read_source(file)
+        if checksum != existing["checksum"]:
+            return False
+        self.state.save_file(self.record_id, file["filename"], size, checksum)
+        return True
+
+    def read_source(self, file):
+        '''This method reads source file without uploading it, to compute its MD5 checksum
+
+        Every file is read at most once by the object
+
+        Args:
+            file (dict): File of the record (with 'filename' and 'uri')
+
+        Returns:
+            tuple: Size of the file and its checksum in Zenodo format ('md5:...'), checksum is None if the file cannot be read
+        '''
+        filename = file["filename"]
+        if filename not in self.source_files:
+            with trace("file_verify", self.record_id, file=filename) as event:
+                with self.session.get(
+                    file["uri"], stream=True, headers={"Accept-Encoding": "identity"}
+                ) as source_response:
+                    event["status_code"] = source_response.status_code
+                    stream = File_stream(source_response)
+                    for _ in stream:
+                        pass
+                event["bytes"] = stream.bytes_read
+            checksum = stream.checksum if source_response.status_code == 200 else None
+            self.source_files[filename] = (stream.bytes_read, checksum)
+        return self.source_files[filename]
+
+    def abort_upload(self, log_variables, dep_id, bucket_url, keep=False):
+        '''This method saves logs of failed upload and removes its deposition
+
+        Args:
+            log_variables (list): List of information about latest upload
+            dep_id (int): ID of Zenodo deposition
+            bucket_url (str): URL of the deposition bucket
+            keep (bool): If True, deposition is kept to be resumed later
+        '''
+        if keep:
+            print("Deposition is kept on Zenodo to be resumed")
+            self.save_logs(log_variables, dep_id, bucket_url)
+            return
+
+        self.session.delete(
+            f"{BASE_URL}api/deposit/depositions/{dep_id}",
+            params=self.params,
+        )
+        print("Deposition will be removed from Zenodo")
         self.save_logs(log_variables)
-        return 0
 
     def post_record(self):
         '''This method posts record on the Zenodo if it has been uploaded previously
         
         
         '''
-        r = requests.post(
-            f"{BASE_URL}api/deposit/depositions/{self.deposition_id}/actions/publish",
-            params=self.params,
-        )
+        doi = self.publish()
+        if doi:
+            self.save_doi(doi)
+
+    def publish(self):
+        '''This method publishes the deposition uploaded previously and returns its DOI
+
+        DOI is taken from the publish response or, if it is not there yet, by polling the deposition
+
+        Returns:
+            str: DOI of published Zenodo record (None if the deposition has not been published)
+        '''
+        with trace("publish", self.record_id) as event:
+            r = self.session.post(
+                f"{BASE_URL}api/deposit/depositions/{self.deposition_id}/actions/publish",
+                params=self.params,
+            )
+            event["status_code"] = r.status_code
         print(f"Record posted with status code {r.status_code}")
-        sleep(3)
 
-        r = requests.get(
-            f"{BASE_URL}api/deposit/depositions/{self.deposition_id}",
-            params=self.params,
-        )
+        # failed publish is checked as well, the deposition may have been published by an earlier try
+        doi = r.json().get("doi") if r.status_code < 300 else None
+        return doi or self.wait_for_doi()
 
-        doi = r.json()["doi"]
+    def wait_for_doi(self):
+        '''This method fetches published deposition until it has DOI, waiting longer each time
 
-        # save doi to csv
-        with open("doi_list.csv", "a") as f:
-            f.write(f"{self.record_id},{doi}\n")
+        Returns:
+            str: DOI of the deposition (None if it is not published or DOI has not appeared)
+        '''
+        for attempt in range(DOI_POLLS):
+            if attempt:
+                sleep(DOI_BACKOFF * 2 ** (attempt - 1))
+            with trace("doi_fetch", self.record_id) as event:
+                r = self.session.get(
+                    f"{BASE_URL}api/deposit/depositions/{self.deposition_id}",
+                    params=self.params,
+                )
+                event["status_code"] = r.status_code
+            if r.status_code >= 500:
+                continue
+            if r.status_code != 200 or not r.json().get("submitted"):
+                break
+            if r.json().get("doi"):
+                return r.json()["doi"]
 
-    def delete_records(self):
-        '''This method removes every record from the Zenodo (unless 429 status code appears)
-        
+        error(f"DOI of record {self.record_id} has not been found")
+        return None
+
+    def waiting_for(self):
+        '''This method returns ID of the record this one succeeds, if its DOI is not known yet
+
+        Metadata of the record refer to the DOI of its predecessor, so it should be published after it
+
+        Returns:
+            int: ID of cedadocs record (None if the record succeeds no record, or its DOI is already known)
         '''
-        r = requests.get(
-            f"{BASE_URL}api/deposit/depositions", params=self.params
-        )
+        cedadocs_record = getattr(self, "cedadocs_record", None)
+        predecessor = cedadocs_record.get("succeeds") if cedadocs_record else None
+        if predecessor is None or predecessor in doi_table.get() or not self.state.is_valid(predecessor):
+            return None
+        return predecessor
+
+    def refresh_metadata(self):
+        '''This method converts metadata again before the deposition is published, and uploads them if they have changed
+
+        Record may have been converted before DOI of its predecessor was published
+
+        Returns:
+            bool: False if the metadata upload failed
+        '''
+        if self.metadata is None or not self.cedadocs_record.get("succeeds"):
+            return True
+
+        converted_hash = metadata_hash(self.metadata)
+        self.convert_metadata()
+        if metadata_hash(self.metadata) == converted_hash:
+            return True
+
+        metadata_response = self.put_metadata(self.deposition_id)
+        print(f"Uploading updated metadata finished with status code {metadata_response.status_code}")
+        if metadata_response.status_code >= 300:
+            return False
+        self.state.update(self.record_id, metadata_hash=metadata_hash(self.metadata))
+        return True
 
-        while r.json()[:-4]:
-            for d in r.json():
-                print(d["id"])
-                r1 = requests.delete(
-                    f'{BASE_URL}api/deposit/depositions/{d["id"]}',
+    def save_doi(self, doi):
+        '''This method saves DOI of published record to the csv file and to the migration state
+
+        Args:
+            doi (str): DOI of published Zenodo record
+        '''
+        save_dois({self.record_id: doi})
+
+    def list_drafts(self):
+        '''This method returns every unpublished deposition of the Zenodo account
+
+        Depositions are listed page by page, CLEANUP_PAGE_SIZE at a time
+        '''
+        drafts = []
+        page = 1
+        while True:
+            r = self.session.get(
+                f"{BASE_URL}api/deposit/depositions",
+                params={**self.params, "status": "draft", "size": CLEANUP_PAGE_SIZE, "page": page},
+            )
+            if r.status_code != 200:
+                error(f"Listing depositions finished with status code {r.status_code}")
+                break
+
+            depositions = r.json()
+            drafts += [d for d in depositions if not d.get("submitted")]
+            if len(depositions) < CLEANUP_PAGE_SIZE:
+                break
+            page += 1
+
+        return drafts
+
+    def delete_deposition(self, dep_id):
+        '''This method removes unpublished deposition, retrying on server errors
+
+        Args:
+            dep_id (int): ID of Zenodo deposition
+
+        Returns:
+            int: Status code of the last attempt (None if it failed without response)
+        '''
+        status_code = None
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                sleep(2 ** attempt)
+            try:
+                r = self.session.delete(
+                    f"{BASE_URL}api/deposit/depositions/{dep_id}",
                     params=self.params,
                 )
-                print(r1)
-            r = requests.get(
-                f"{BASE_URL}api/deposit/depositions", params=self.params
-            )
+            except requests.RequestException as e:
+                print(f"Removing deposition {dep_id} failed with {e!r}")
+                continue
+
+            status_code = r.status_code
+            # only server errors are worth another try, 429 is already retried by the session
+            if status_code < 500:
+                break
+        return status_code
+
+    def delete_records(self, dry_run=False):
+        '''This method removes unpublished depositions created by the migration from the Zenodo
+
+        Only depositions created by the migration (including ones replaced by later runs) are removed,
+        CLEANUP_WORKERS at the same time
+
+        Args:
+            dry_run (bool): If True, depositions are only listed
+        '''
+        records_by_deposition = self.state.drafts()
+        drafts = [d for d in self.list_drafts() if d["id"] in records_by_deposition]
+        print(f"{len(drafts)} unpublished depositions created by the migration")
 
-    @staticmethod
-    def save_logs(log_variables):
-        '''This method puts logs to the csv file
+        if dry_run:
+            for d in drafts:
+                print(f'{d["id"]} (record {records_by_deposition[d["id"]]}): {d.get("metadata", {}).get("title", "")}')
+            return
+
+        def delete(deposition):
+            dep_id = deposition["id"]
+            status_code = self.delete_deposition(dep_id)
+            print(f"Deposition {dep_id} removed with status code {status_code}")
+            if status_code is not None and (status_code < 300 or status_code == 404):
+                self.state.forget_deposition(records_by_deposition[dep_id], dep_id)
+
+        with ThreadPoolExecutor(max_workers=CLEANUP_WORKERS) as executor:
+            list(executor.map(delete, drafts))
+
+    def save_logs(self, log_variables, deposition_id=None, bucket_url=None, lastmod=None):
+        '''This method puts logs to the csv file and to the migration state
         
         Args:
             log_variables (list): List of information about latest upload
+            deposition_id (int): ID of Zenodo deposition, if it has been created
+            bucket_url (str): URL of the deposition bucket, if it has been created
+            lastmod (str): Last modification of the uploaded cedadocs record, if it has been uploaded
         '''
-        with open("errors.csv", "a") as f:
+        with LOG_LOCK, open("errors.csv", "a") as f:
             f.write(",".join(log_variables) + "\n")
+        self.state.save_upload(log_variables, deposition_id, bucket_url, lastmod)
+
+
+def get_lastmod(cedadocs_record):
+    '''This function returns time of the last modification of cedadocs record
+
+    Records without 'lastmod' have not been modified since they were deposited
+    '''
+    return cedadocs_record.get("lastmod") or cedadocs_record.get("datestamp")
+
+
+def save_dois(dois):
+    '''This function saves DOIs of published records to the migration state, the DOI map and the csv file at once
+
+    Args:
+        dois (dict): DOIs of published Zenodo records by cedadocs record ID
+    '''
+    register_dois(dois)
+    append_dois(dois)
+
+
+def register_dois(dois):
+    '''This function saves DOIs of published records to the migration state and the DOI map
+
+    Records converted afterwards can refer to them at once, even before they are appended to doi_list.csv (see append_dois)
+
+    Args:
+        dois (dict): DOIs of published Zenodo records by cedadocs record ID
+    '''
+    get_state().save_dois(dois)
+    doi_table.add_pending(dois)
+
+
+def append_dois(dois):
+    '''This function appends DOIs registered by register_dois to doi_list.csv
+
+    Args:
+        dois (dict): DOIs of published Zenodo records by cedadocs record ID
+    '''
+    with LOG_LOCK:
+        with open("doi_list.csv", "a") as f:
+            f.writelines(f"{record_id},{doi}\n" for record_id, doi in dois.items())
+        # cached DOI map is updated without reading the file again
+        doi_table.update(dois)
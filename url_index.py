@@ -0,0 +1,178 @@
+import json
+import os
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from lookup_tables import Table_cache, url_table
+from tracing import trace
+
+URL_INDEX_FILE = "url_index.json"
+
+# number of hosts probed at the same time and timeout of a single probe in seconds
+PROBE_WORKERS = 16
+PROBE_TIMEOUT = 5
+
+# results of base urls probed by this process outside of the index
+_probed = dict()
+_probed_lock = Lock()
+
+
+def normalize_url(url):
+    '''This function returns url in the form used as the key of the index
+
+    Surrounding whitespace is removed, scheme and host are lower-cased
+
+    Args:
+        url (str): URL as written in cedadocs record
+    '''
+    parts = urlsplit(url.strip())
+    return urlunsplit(
+        (parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, parts.fragment)
+    )
+
+
+def get_base_url(url):
+    '''This function returns basic url (scheme and host) of given url
+
+    '''
+    parts = urlsplit(url.strip())
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def resolve_from_sheet(entry):
+    '''This function returns url given by the sheet entry
+
+    Returns:
+        None if url is correct and should be kept, alternative url if there is one,
+        empty string if it has to be probed
+    '''
+    status, redirected_url, suggested_url = entry
+    if status == "Correct":
+        return None
+    return suggested_url or redirected_url or ""
+
+
+def probe(base_url, record_id=None):
+    '''This function checks if given url answers with status code 200
+
+    Args:
+        base_url (str): URL to be checked
+        record_id (int): ID of cedadocs record the url belongs to, used for tracing
+
+    Returns:
+        int: Status code of the response (None if there has been no response)
+    '''
+    from http_session import get_session
+
+    status_code = None
+    with trace("url_probe", record_id, url=base_url) as event:
+        try:
+            status_code = get_session().get(
+                base_url, verify=False, timeout=PROBE_TIMEOUT
+            ).status_code
+            event["status_code"] = status_code
+        except Exception as e:
+            # event without response has no status code, only the error
+            event["error"] = repr(e)
+            print(f"Probing {base_url} failed with {e!r}")
+    return status_code
+
+
+def probe_once(base_url, record_id=None):
+    '''This function probes base url unless it has already been probed by this process
+
+    Returns:
+        bool: True if the url answers with status code 200
+    '''
+    with _probed_lock:
+        if base_url in _probed:
+            return _probed[base_url]
+    alive = probe(base_url, record_id) == 200
+    with _probed_lock:
+        _probed[base_url] = alive
+    return alive
+
+
+def load_url_index(path):
+    '''This function loads index of resolved urls
+
+    Args:
+        path (str): Path to JSON file written by build_index
+
+    Returns:
+        dict: Resolved url by normalized url: None if url should be kept, empty string if it is broken
+    '''
+    with open(path) as f:
+        return json.load(f)["urls"]
+
+
+def build_index(records, path=URL_INDEX_FILE, workers=PROBE_WORKERS, refresh=False):
+    '''This function resolves 'official_url' of every record and saves results in the index
+
+    Urls are joined with the url sheet first. Base urls of the ones which cannot be resolved that way
+    are probed, each host only once and `workers` hosts at the same time.
+    Hosts probed by an earlier build are not probed again, unless `refresh` is True
+
+    Args:
+        records (iterable): cedadocs records (JSON representations)
+        path (str): Path to the JSON file of the index
+        workers (int): Number of hosts probed at the same time
+        refresh (bool): If True, every host is probed again
+
+    Returns:
+        dict: Number of indexed urls, probed hosts and broken urls
+    '''
+    # urls are matched with the sheet as they are first, then in normalized form
+    url_map = url_table.get()
+    normalized_map = {normalize_url(url): entry for url, entry in url_map.items()}
+
+    hosts = dict()
+    if not refresh and os.path.exists(path):
+        with open(path) as f:
+            hosts = json.load(f)["hosts"]
+
+    urls = dict()
+    unresolved = dict()
+    for record in records:
+        if "official_url" not in record:
+            continue
+        url = record["official_url"]
+        key = normalize_url(url)
+        if key in urls or key in unresolved:
+            continue
+
+        entry = url_map.get(url) or normalized_map.get(key)
+        resolved = resolve_from_sheet(entry) if entry else ""
+        if resolved == "":
+            unresolved[key] = (get_base_url(key), record["eprintid"])
+        else:
+            urls[key] = resolved
+
+    # every host is probed once, however many of its urls are broken
+    to_probe = dict()
+    for base_url, record_id in unresolved.values():
+        if base_url not in hosts:
+            to_probe.setdefault(base_url, record_id)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for base_url, status_code in zip(
+            to_probe, executor.map(probe, to_probe, to_probe.values())
+        ):
+            hosts[base_url] = status_code
+
+    for key, (base_url, _) in unresolved.items():
+        urls[key] = base_url if hosts[base_url] == 200 else ""
+
+    # index is replaced at once, so readers never see a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"urls": urls, "hosts": hosts}, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+    return {
+        "urls": len(urls),
+        "probed": len(to_probe),
+        "broken": sum(1 for resolved in urls.values() if resolved == ""),
+    }
+
+
+url_index = Table_cache(URL_INDEX_FILE, load_url_index)